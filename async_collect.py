@@ -0,0 +1,210 @@
+#! /usr/bin/python3
+"""Collect a whole division with asyncio instead of threads
+
+Rosters, then skill levels and stats pages for every player, are fetched
+with aiohttp on one event loop.  A semaphore bounds the requests in flight
+and a per-host limiter spaces them out, so many slow page loads overlap
+without hammering the site.  Timeouts, dropped connections and 429 or
+5xx responses are retried with backoff like rate_limit.RequestScheduler
+does.  Pages are parsed with stat_pages and players are saved to the same
+database collect_data.py uses.
+
+This path only fetches: it doesn't use collect_data.py's page cache or
+checkpoint.  A player whose pages fail or can't be parsed is reported and
+left out, run again to fill them in.
+
+Needs python 3.7+ and aiohttp.
+"""
+
+import asyncio
+import random
+from urllib.parse import urlsplit
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+import stat_pages
+from rate_limit import transient
+from storage import Storage
+
+DIVISION = 9321
+TEAMS = None  # None collects every team in the division
+SITE = "https://www.napaleagues.com"
+BASEURL = "%s/stats.php?playerSelected=Y&playerID" % SITE
+ROSTERSURL = "%s/roster_grid.php?did=%s" % (SITE, DIVISION)
+CONCURRENCY = 8
+REQUESTS_PER_SECOND = 4.0
+TIMEOUT = 30
+RETRIES = 3
+BACKOFF = 1.0  # seconds before the first retry, doubled every retry
+DATABASE = "napa.db"
+
+GAME_TABS = {"8_ball": "2", "9_ball": "3", "10_ball": "4"}
+MAX_STATS_PAGES = 4  # 10 matches per page, None keeps going until the last page
+MAX_STATS_PAGES_LIMIT = 100  # pages read at most when MAX_STATS_PAGES is None
+
+
+class HostRateLimiter(object):
+    """Space requests to each host at least 1 / requests_per_second apart"""
+
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self.next_request = {}
+
+    async def wait(self, host):
+        now = asyncio.get_running_loop().time()
+        start = max(now, self.next_request.get(host, 0.0))
+        self.next_request[host] = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+class AsyncFetcher(object):
+    """Fetch page source with bounded concurrency and a per-host rate limit
+
+    args:
+      session(aiohttp.ClientSession):  shared connection pool
+      concurrency(int):  maximum requests in flight
+      requests_per_second(float):  maximum request rate per host
+      retries(int):  attempts after the first for transient errors
+      backoff(float):  seconds before the first retry, doubled every retry
+    """
+
+    def __init__(
+        self,
+        session,
+        concurrency=CONCURRENCY,
+        requests_per_second=REQUESTS_PER_SECOND,
+        retries=RETRIES,
+        backoff=BACKOFF,
+    ):
+        self.session = session
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.limiter = HostRateLimiter(requests_per_second)
+        self.retries = retries
+        self.backoff = backoff
+        self.requests = 0
+        self.retried = 0
+
+    async def get(self, url):
+        """Get a page's source, retrying transient errors (see rate_limit.transient)"""
+        for attempt in range(self.retries + 1):
+            try:
+                return await self.fetch(url)
+            except Exception as error:
+                if attempt == self.retries or not transient(error):
+                    raise
+                self.retried += 1
+            await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    async def fetch(self, url):
+        async with self.semaphore:
+            await self.limiter.wait(urlsplit(url).netloc)
+            self.requests += 1
+            async with self.session.get(url) as response:
+                response.raise_for_status()
+                return await response.text()
+
+
+async def get_rosters(fetcher, url=ROSTERSURL):
+    """Get players name and player ID per team (see collect_data.get_rosters)"""
+    return stat_pages.parse_rosters(await fetcher.get(url))
+
+
+async def get_player_skill_levels(fetcher, player_id, baseurl=BASEURL):
+    """Get 8ball, 9ball, 10ball skill levels, None when the page can't be read"""
+    try:
+        source = await fetcher.get("%s=%s" % (baseurl, player_id))
+        return stat_pages.parse_skill_levels(source)
+    except (aiohttp.ClientError, asyncio.TimeoutError, IndexError, ValueError):
+        return None
+
+
+async def get_player_stats(fetcher, player_id, game, baseurl=BASEURL, max_pages=MAX_STATS_PAGES):
+    """Get stats per game for a player (see collect_data.get_player_stats)
+
+    Pages are read in order and paging stops at a page with fewer than
+    stat_pages.PAGE_SIZE matches or the same matches as the page before it,
+    other players and game tabs are fetched meanwhile.
+    """
+    results = {}
+    last_keys = None
+    for page in range(MAX_STATS_PAGES_LIMIT if max_pages is None else max_pages):
+        source = await fetcher.get(
+            "%s=%s&xTab=%s&start=%s" % (baseurl, player_id, GAME_TABS[game], page * 10)
+        )
+        page_results = {}
+        keys = stat_pages.parse_stats_page(source, page_results)
+        if keys == last_keys:  # the site served the last page again
+            break
+        results = stat_pages.merge_results(results, page_results)
+        if len(keys) < stat_pages.PAGE_SIZE:
+            break
+        last_keys = keys
+    return results
+
+
+async def collect_player(fetcher, player, record, baseurl=BASEURL):
+    """Fill in skill_level and stats per game for one player record"""
+    try:
+        skill_level, *stats = await asyncio.gather(
+            get_player_skill_levels(fetcher, record["player_id"], baseurl),
+            *[
+                get_player_stats(fetcher, record["player_id"], game, baseurl)
+                for game in GAME_TABS
+            ]
+        )
+    except (aiohttp.ClientError, asyncio.TimeoutError, IndexError, ValueError) as error:
+        print("Failed to collect %s: %s" % (player, error))
+        return
+    record["skill_level"] = skill_level
+    for game, results in zip(GAME_TABS, stats):
+        record[game] = results
+
+
+async def collect_division(
+    rostersurl=ROSTERSURL,
+    baseurl=BASEURL,
+    teams=TEAMS,
+    concurrency=CONCURRENCY,
+    requests_per_second=REQUESTS_PER_SECOND,
+):
+    """Collect rosters, skill levels and stats for a division
+
+    args:
+      rostersurl(str):  URL to get division rosters
+      baseurl(str):  player stats URL up to the player ID
+      teams(list):  team names to collect, None for every team
+      concurrency(int):  maximum requests in flight
+      requests_per_second(float):  maximum request rate per host
+
+    returns:
+      players(dict):  {team: {name: record}} like storage.Storage.load_players
+    """
+    if aiohttp is None:
+        raise ImportError("aiohttp is required for async collection")
+    timeout = aiohttp.ClientTimeout(total=TIMEOUT)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        fetcher = AsyncFetcher(session, concurrency, requests_per_second)
+        players = await get_rosters(fetcher, rostersurl)
+        await asyncio.gather(
+            *[
+                collect_player(fetcher, player, players[team][player], baseurl)
+                for team in (players if teams is None else teams)
+                for player in players[team]
+            ]
+        )
+    print("%s page requests, %s retries" % (fetcher.requests, fetcher.retried))
+    return players
+
+
+if __name__ == "__main__":
+    players = asyncio.run(collect_division())
+    storage = Storage(DATABASE)
+    storage.save_players(
+        dict((team, players[team]) for team in (players if TEAMS is None else TEAMS))
+    )
+    storage.close()
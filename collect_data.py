@@ -1,21 +1,63 @@
 #! /usr/bin/python2
 
+import multiprocessing
+import os
 import pickle
-import random
-import time
-
-from selenium import webdriver
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from selenium import webdriver
+except ImportError:
+    webdriver = None
+
+import stat_pages
+from http_browser import HttpBrowser
+from page_cache import CachedBrowser, PageCache
+from rate_limit import RequestScheduler, ThrottledBrowser
+from races import get_race
+from simulations import SimulationCache, reseed, stream_seed
+from storage import Storage
 
 OPPONENT = "Rack And Run"
 US = "Zoosters Millions"
 DIVISION = 9321
 SIMULATION_COUNT = 100000
+SIMULATION_METHOD = "exact"
+SEED = None  # master seed for monte_carlo and batch, None only draws uncached races
+SIMULATION_CACHE = "simulation_cache.pkl"
+DATABASE = "napa.db"
 GRAPHS = "one_line"
 
-BASEURL = "https://www.napaleagues.com/stats.php?playerSelected=Y&playerID"
-ROSTERSURL = "https://www.napaleagues.com/roster_grid.php?did=%s" % DIVISION
+SITE = "https://www.napaleagues.com"
+BASEURL = "%s/stats.php?playerSelected=Y&playerID" % SITE
+ROSTERSURL = "%s/roster_grid.php?did=%s" % (SITE, DIVISION)
 
 WEBDRIVER = "Chrome"
+WORKERS = 4
+REQUESTS_PER_SECOND = 4.0
+MAX_REQUESTS_PER_SECOND = 10.0
+RETRIES = 3
+CAPTURE_DIRECTORY = None
+CACHE_DIRECTORY = None  # directory to keep fetched pages in between runs
+CACHE_TTLS = {
+    "rosters": 7 * 24 * 60 * 60,
+    "skill_levels": 7 * 24 * 60 * 60,
+    "stats": 24 * 60 * 60,
+}  # seconds, None never expires
+CACHE_MAX_BYTES = 200 * 1024 * 1024
+OFFLINE = False  # only read pages from CACHE_DIRECTORY
+CHECKPOINT = "checkpoint.pkl"  # players finished so far this run, None to disable
+PARSER = "page_source"
+MAX_STATS_PAGES = 4  # 10 matches per page, None keeps going until the last page
+MAX_STATS_PAGES_LIMIT = 100  # pages read at most when MAX_STATS_PAGES is None
+INCREMENTAL = False  # only read matches newer than the ones already in DATABASE
+PIPELINE = False  # simulate pairings while the rest of the players are collected
+PROCESSES = 1  # simulation processes for PIPELINE, None uses every CPU
 
 
 XPATHS = {
@@ -26,12 +68,13 @@ XPATHS = {
 }
 
 
-def get_rosters(browser, url):
+def get_rosters(browser, url, parser=PARSER):
     """Get Fosters for a division
     
     args:
       browser(selenium.webdriver):  Handle to the selenium webdriver class
       url(str):  URL to get division rosters
+      parser(str):  values("page_source", "webdriver")
       
     returns:
         players(dict):  Dictionary players name and player ID per team in the division
@@ -47,6 +90,8 @@ def get_rosters(browser, url):
     players = {}
     browser.get(url)
     browser.implicitly_wait(6)
+    if parser == "page_source":
+        return stat_pages.parse_rosters(browser.page_source)
     for row in browser.find_elements_by_xpath("/html/body/table/tbody/tr"):
         for team in row.find_elements_by_xpath("./td"):
             teamname = None
@@ -63,80 +108,12 @@ def get_rosters(browser, url):
     return players
 
 
-def get_race(player1skill, player2skill):
-    """Get the race between 2 players
-    
-    args:
-      player1skill(int): skill rating of our player
-      player2skill(int): skill rating of the opponent player
-      
-    returns:
-      (unnamed list):  (ourrace, theirrace)
-    """
-    race_tables = {
-        89: {
-            74: (10, 2),
-            68: (9, 2),
-            58: (8, 2),
-            48: (9, 3),
-            42: (8, 3),
-            35: (7, 3),
-            28: (8, 4),
-            22: (7, 4),
-            17: (6, 4),
-            11: (7, 5),
-            4: (6, 5),
-            -1: (6, 6),
-        },
-        69: {
-            62: (8, 2),
-            56: (7, 2),
-            46: (6, 2),
-            36: (7, 3),
-            28: (6, 3),
-            21: (5, 3),
-            14: (6, 4),
-            5: (5, 4),
-            -1: (5, 5),
-        },
-        49: {
-            48: (6, 2),
-            39: (5, 2),
-            29: (4, 2),
-            18: (5, 3),
-            6: (4, 3),
-            -1: (4, 4),
-        },
-        39: {
-            26: (4, 2),
-            10: (3, 2),
-            -1: (3, 3),
-        },
-        -1: {
-            19: (3, 2),
-            -1: (2, 2),
-        },
-    }
-    stronger = max(player1skill, player2skill)
-    weaker = min(player1skill, player2skill)
-    difference = stronger - weaker
-    for skillclass in reversed(sorted(race_tables)):
-        if stronger > skillclass:
-            for skill_level_difference in reversed(sorted(race_tables[skillclass])):
-                if difference > skill_level_difference:
-                    if stronger == player1skill:
-                        return list(race_tables[skillclass][skill_level_difference])
-                    else:
-                        return list(
-                            reversed(race_tables[skillclass][skill_level_difference])
-                        )
-
-
 def create_connection(driver=WEBDRIVER):
     """Create a connection to the web driver
 
     args:
-        driver(str): Which webdriver (Chrome default)
+        driver(str): Which webdriver (Chrome default, http fetches pages
+          without a browser and needs PARSER = "page_source")
     returns:
         browser(selenium.webdriver):  Handle to the selenium webdriver class
     """
@@ -144,25 +121,59 @@ def create_connection(driver=WEBDRIVER):
     if driver == "Chrome":
         browser = webdriver.Chrome()
         browser.implicitly_wait(10)
+    elif driver == "http":
+        browser = HttpBrowser(capture_directory=CAPTURE_DIRECTORY)
     else:
         pass
 
     return browser
 
 
-def get_player_skill_levels(browser, player_id):
+def open_browser(scheduler, cache=None):
+    """Open a browser whose page loads go through the scheduler and cache
+
+    args:
+      scheduler(rate_limit.RequestScheduler):  shared request scheduler
+      cache(page_cache.PageCache):  optional shared page cache
+
+    returns:
+      browser:  ThrottledBrowser, wrapped in a CachedBrowser when there is a
+        cache.  Offline it only reads the cache and no browser is started.
+    """
+    if PARSER != "page_source" and (
+        cache is not None or OFFLINE or WEBDRIVER == "http"
+    ):
+        # neither has the browser's find_element calls, a cached page is
+        # never loaded in the browser they would read
+        raise ValueError(
+            'The page cache, OFFLINE and the http WEBDRIVER need PARSER = "page_source"'
+        )
+    if OFFLINE:
+        if cache is None:
+            raise ValueError("OFFLINE needs a CACHE_DIRECTORY to read pages from")
+        return CachedBrowser(None, cache, offline=True)
+    browser = ThrottledBrowser(create_connection(WEBDRIVER), scheduler)
+    if cache is not None:
+        browser = CachedBrowser(browser, cache)
+    return browser
+
+
+def get_player_skill_levels(browser, player_id, parser=PARSER):
     """Get 8ball, 9ball, 10ball skill levels for a player
     
     args:
       browser(selenium.webdriver):  Handle to the selenium webdriver class
       player_id(int):  player ID number
+      parser(str):  values("page_source", "webdriver")
       
     returns:
       (unnamed list):  (8ball_skill_level, 9ball_skill_level, 10ball_skill_level)
     """
+    browser.get("%s=%s" % (BASEURL, player_id))
+    browser.implicitly_wait(6)
     try:
-      browser.get("%s=%s" % (BASEURL, player_id))
-      browser.implicitly_wait(6)
+      if parser == "page_source":
+        return stat_pages.parse_skill_levels(browser.page_source)
 
       sl8 = browser.find_element_by_xpath(XPATHS["8ball_skill"]).text.split()[0]
       sl9 = browser.find_element_by_xpath(XPATHS["9ball_skill"]).text.split()[0]
@@ -172,13 +183,32 @@ def get_player_skill_levels(browser, player_id):
       pass
 
 
-def get_player_stats(browser, player_id, game):
+def get_player_stats(
+    browser,
+    player_id,
+    game,
+    parser=PARSER,
+    max_pages=MAX_STATS_PAGES,
+    watermark=None,
+    match_keys=None,
+):
     """Get stats per game for a player
     
     args:
       browser(selenium.webdriver):  Handle to the selenium webdriver class
       player_id(int): Player ID number
       game(str):  values("8_ball, 9_ball, 10_ball)
+      parser(str):  values("page_source", "webdriver")
+        page_source parses each page once with stat_pages,
+        webdriver asks the browser for every cell
+      max_pages(int):  most stats pages to read, None for every page up to
+        MAX_STATS_PAGES_LIMIT.  Paging stops early at a page with fewer
+        than stat_pages.PAGE_SIZE matches or the same matches as the page
+        before it.
+      watermark(str):  stat_pages.match_key of the newest match already
+        counted, paging stops when it is reached and only newer matches count
+      match_keys(list):  optional list to append the key of every match read
+        to, newest first
 
     returns:
       results(dict):  Dictionary of the results by difference in games needed to win the race
@@ -190,18 +220,40 @@ def get_player_stats(browser, player_id, game):
           }
     """
     results = {}
+    if match_keys is None:
+        match_keys = []
     game_tabs = {"8_ball": "2", "9_ball": "3", "10_ball": "4"}
-    for page in ["0", "10", "20", "30"]:
-        time.sleep(0.5)
+    last_keys = None
+    for page in range(MAX_STATS_PAGES_LIMIT if max_pages is None else max_pages):
         browser.get(
-            "%s=%s&xTab=%s&start=%s" % (BASEURL, player_id, game_tabs[game], page)
+            "%s=%s&xTab=%s&start=%s" % (BASEURL, player_id, game_tabs[game], page * 10)
         )
         browser.implicitly_wait(6)
+        if parser == "page_source":
+            page_results = {}
+            page_keys = stat_pages.parse_stats_page(
+                browser.page_source, page_results, watermark
+            )
+            if page_keys == last_keys:  # the site served the last page again
+                break
+            results = stat_pages.merge_results(results, page_results)
+            match_keys.extend(page_keys)
+            if len(page_keys) < stat_pages.PAGE_SIZE or watermark in page_keys:
+                break
+            last_keys = page_keys
+            continue
         this_player = browser.find_element_by_xpath(
             "/html/body/div/div/div/table[1]/tbody/tr[2]/td/h2"
         ).text
         matches = browser.find_elements_by_class_name("card-body")
-        for match in matches:
+        page_keys = [stat_pages.match_key(match.text) for match in matches]
+        if not matches or page_keys == last_keys:
+            break
+        last_keys = page_keys
+        for match, key in zip(matches, page_keys):
+            match_keys.append(key)
+            if key == watermark:
+                break
             try: 
                 tables = match.find_elements_by_xpath("./table")
                 for table in tables[2:-2]:
@@ -238,250 +290,533 @@ def get_player_stats(browser, player_id, game):
                         ] + int(table.find_element_by_xpath("./tbody/tr[7]/td[2]").text)
             except: #FIXME: Learn how to process results from an "MVP player"
                 pass
+        if watermark in match_keys or len(matches) < stat_pages.PAGE_SIZE:
+            break
 
     return results
 
 
-def run_simulations(combined_win_percentage, my_race, their_race, SIMULATION_COUNT):
-    """Run simulations based on combined_win_percentage, games needed for a win
-    and bucket the results across the points received per simulation
-    
+def collect_player(browser, record, previous=None):
+    """Get skill levels and stats per game for one player
+
+    With a previous record only matches newer than its watermarks are read
+    and added to its stats.  A game whose watermark is not found again is
+    read in full.
+
     args:
-      combined_win_percentage(float):  Average of (
-        our player's percentage games won  at this race,
-        their player's percentage games lost at this race
-      )
-      my_race(int):  games needed for our player to win
-      their_race(int):  games needed for their player to win
-      SIMULATION_COUNT(int):  Number of iterations to get the counts.
+      browser(selenium.webdriver):  Handle to the selenium webdriver class
+      record(dict):  player record from get_rosters, updated in place
+      previous(dict):  optional record for the same player from an earlier run
 
     returns:
-      results(dict):  Dictionary of simulation result counts bucketed by points earned by our player
-        ex.
-          results{
-            1:  5000,
-            3:  30000,
-            6:  30000,
-            14: 30000,
-            20: 5000,
-          } 
+      record(dict):  with skill_level, 8_ball, 9_ball, 10_ball and watermarks
+        (newest match key per game) added
     """
-    results = {
-        1: 0,  # no wins
-        3: 0,  # 1 win
-        6: 0,  # hill loss
-        14: 0,  # match win
-        20: 0,  # shutout
-    }
-    for x in range(0, SIMULATION_COUNT):
-        games_won = 0
-        games_lost = 0
-        while True:
-            if combined_win_percentage > random.randrange(100):
-                games_won += 1
-            else:
-                games_lost += 1
-            if any((games_won == my_race, games_lost == their_race)):
-                break
-        if games_lost == their_race:  # I lost
-            if games_won == my_race - 1:
-                results[6] += 1
-            elif games_won > 0:
-                results[3] += 1
-            else:
-                results[1] += 1
-        else:  # I won
-            if games_lost == 0:
-                results[20] += 1
-            else:
-                results[14] += 1
-    return results
+    record["skill_level"] = get_player_skill_levels(browser, record["player_id"])
+    watermarks = {}
+    for game in ["8_ball", "9_ball", "10_ball"]:
+        watermark = None
+        if previous is not None and previous.get(game) is not None:
+            watermark = previous.get("watermarks", {}).get(game)
+        match_keys = []
+        results = get_player_stats(
+            browser,
+            record["player_id"],
+            game,
+            watermark=watermark,
+            match_keys=match_keys,
+        )
+        if watermark is not None and watermark in match_keys:
+            results = stat_pages.merge_results(previous[game], results)
+        record[game] = results
+        watermarks[game] = match_keys[0] if match_keys else None
+    record["watermarks"] = watermarks
+    return record
 
 
-browser = create_connection(WEBDRIVER)
-players = get_rosters(browser, ROSTERSURL)
+def load_checkpoint(path):
+    """Load the players finished so far in an interrupted run
 
-for player in players[US]:
-    players[US][player].setdefault("skill_level", [])
-    players[US][player]["skill_level"] = get_player_skill_levels(
-        browser, players[US][player]["player_id"]
-    )
-    print("DEBUG: %s" % players[US][player]["skill_level"])
-    for game in ["8_ball", "9_ball", "10_ball"]:
-        players[US][player].setdefault(game, [])
-        players[US][player][game] = get_player_stats(
-            browser, players[US][player]["player_id"], game
-        )
+    args:
+      path(str):  checkpoint file written by save_checkpoint
 
-for player in players[OPPONENT]:
-    players[OPPONENT][player].setdefault("skill_level", [])
-    players[OPPONENT][player]["skill_level"] = get_player_skill_levels(
-        browser, players[OPPONENT][player]["player_id"]
-    )
-    for game in ["8_ball", "9_ball", "10_ball"]:
-        players[OPPONENT][player].setdefault(game, [])
-        players[OPPONENT][player][game] = get_player_stats(
-            browser, players[OPPONENT][player]["player_id"], game
-        )
+    returns (finished(dict), end(int)):  player records by (team, player),
+      empty when there is no checkpoint, and the length of the file up to
+      the last whole record.  A last record cut short by a crash is ignored
+      and should be truncated away (at end) before more are appended.
+    """
+    finished = {}
+    end = 0
+    if path is None or not os.path.exists(path):
+        return finished, end
+    checkpoint = open(path, "rb")
+    while True:
+        try:
+            team, player, record = pickle.load(checkpoint)
+        # a record only partly written, python 2's pickle raises TypeError
+        # when the data runs out in the middle of an opcode
+        except (EOFError, pickle.UnpicklingError, ValueError, IndexError, TypeError):
+            break
+        finished[(team, player)] = record
+        end = checkpoint.tell()
+    checkpoint.close()
+    return finished, end
+
+
+def save_checkpoint(path, team, player, record):
+    """Append a finished player record to the checkpoint file"""
+    checkpoint = open(path, "ab")
+    pickle.dump((team, player, record), checkpoint, 2)
+    checkpoint.flush()
+    os.fsync(checkpoint.fileno())
+    checkpoint.close()
+
+
+def collect_players(
+    players,
+    teams,
+    scheduler,
+    workers=WORKERS,
+    previous=None,
+    cache=None,
+    checkpoint=CHECKPOINT,
+    on_collected=None,
+):
+    """Collect every player on teams with a pool of workers
+
+    Each worker opens its own browser and pulls players from a queue.  All
+    workers share one request scheduler, which sets the page load rate
+    across workers and retries failed page loads.
 
-data_file = open("data.pkl", "wb")
-pickle.dump(players, data_file)
-data_file.close()
+    args:
+      players(dict):  rosters from get_rosters, updated in place
+      teams(list):  team names to collect
+      scheduler(rate_limit.RequestScheduler):  shared request scheduler
+      workers(int):  number of concurrent browsers
+      previous(dict):  optional players from an earlier run, only newer
+        matches are read for players found in it (see collect_player) and
+        a player that fails to collect keeps its record from there
+      cache(page_cache.PageCache):  optional page cache shared by the workers
+      checkpoint(str):  file every finished player is appended to, players
+        already in it are not collected again.  Delete it once the run's
+        data is saved.
+      on_collected(function):  optional, called with (team, player, record)
+        for every player as soon as it is collected (from the worker's
+        thread) or read from the checkpoint
 
-players = {}
-data_file = open("data.pkl", "rb")
-players = pickle.load(data_file)
+    returns:
+      players(dict):  rosters with every collected player filled in
+    """
+    finished, end = load_checkpoint(checkpoint)
+    if checkpoint is not None and os.path.exists(checkpoint):
+        # drop a record cut short by a crash so new ones follow whole ones
+        with open(checkpoint, "r+b") as checkpoint_file:
+            checkpoint_file.truncate(end)
+    jobs = queue.Queue()
+    # alternate between teams so both have players collected early on
+    rosters = [[(team, player) for player in players[team]] for team in teams]
+    for index in range(max([0] + [len(roster) for roster in rosters])):
+        for roster in rosters:
+            if index >= len(roster):
+                continue
+            team, player = roster[index]
+            record = finished.get((team, player))
+            if record is not None and (
+                record["player_id"] == players[team][player]["player_id"]
+            ):
+                players[team][player].update(record)
+                if on_collected is not None:
+                    on_collected(team, player, players[team][player])
+                continue
+            jobs.put((team, player))
+    if jobs.empty():
+        return players
+    lock = threading.Lock()
+    if previous is None:
+        previous = {}
+
+    def work():
+        browser = open_browser(scheduler, cache)
+        try:
+            while True:
+                try:
+                    team, player = jobs.get_nowait()
+                except queue.Empty:
+                    return
+                last_run = previous.get(team, {}).get(player)
+                if last_run is not None and (
+                    last_run.get("player_id") != players[team][player]["player_id"]
+                ):
+                    last_run = None
+                try:
+                    record = collect_player(
+                        browser, dict(players[team][player]), last_run
+                    )
+                except Exception as error:
+                    print "Failed to collect %s: %s" % (player, error)
+                    if last_run is None or "skill_level" not in last_run:
+                        continue
+                    # keep the earlier run's record, it isn't checkpointed so
+                    # a resumed run tries the player again
+                    record = dict(last_run)
+                    with lock:
+                        players[team][player].update(record)
+                    if on_collected is not None:
+                        on_collected(team, player, record)
+                    continue
+                with lock:
+                    players[team][player].update(record)
+                    if checkpoint is not None:
+                        save_checkpoint(checkpoint, team, player, record)
+                if on_collected is not None:
+                    on_collected(team, player, record)
+                if team == US:
+                    print("DEBUG: %s" % record["skill_level"])
+        finally:
+            browser.close()
+
+    threads = [threading.Thread(target=work) for x in range(max(1, workers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return players
 
 
-predictions = {}
-for player in players[US]:
-    predictions.setdefault(player, {})
-    game_map = {0: "8  ", 1: "9  ", 2: "10 "}
+def player_header(player, record):
+    """Get the heading printed above a player's pairings, None without skill levels"""
     try:
-	    print (
-		"\n\n#### %s %s ####"
-		% (
-		    player,
-		    " ".join(
-			[
-			    str(players[US][player]["skill_level"][0]),
-			    str(players[US][player]["skill_level"][1]),
-			    str(players[US][player]["skill_level"][2]),
-			]
-		    ),
-		)
-	    )
-    except:
-        pass
-    for against in players[OPPONENT]:
-        try:
-            predictions[player].setdefault(against, {})
-            seed_games = {"8_ball": 0, "9_ball": 0, "10_ball": 0}
-            results = {}
-            for bucket in ["c_loss", "loss", "h_loss", "win", "c_win", "one_line"]:
-                results.setdefault(bucket, [])
-            game_index = 0
-            races = []
-            for game in ("8_ball", "9_ball", "10_ball"):
-                predictions[player][against].setdefault(game, 10)
-                my_race, their_race = get_race(
-                    players[US][player]["skill_level"][game_index],
-                    players[OPPONENT][against]["skill_level"][game_index],
-                )
-                skill_difference = my_race - their_race
-                combined_wins = 0
-                combined_losses = 0
-                for spread in [-1, 0, 1]:
-                    if (int(skill_difference) + int(spread)) in players[US][player][
-                        game
-                    ]:
-                        combined_wins = (
-                            combined_wins
-                            + players[US][player][game][skill_difference + spread][
-                                "games_won"
-                            ]
-                        )
-                        combined_losses = (
-                            combined_losses
-                            + players[US][player][game][skill_difference + spread][
-                                "games_lost"
-                            ]
-                        )
-                    if ((int(skill_difference) + int(spread)) * -1) in players[
-                        OPPONENT
-                    ][against][game]:
-                        combined_wins = (
-                            combined_wins
-                            + players[OPPONENT][against][game][
-                                (skill_difference + spread) * -1
-                            ]["games_lost"]
-                        )
-                        combined_losses = (
-                            combined_losses
-                            + players[OPPONENT][against][game][
-                                (skill_difference + spread) * -1
-                            ]["games_won"]
-                        )
-                combined_total = combined_wins + combined_losses
-                seed_games[game] = seed_games[game] + combined_total
-                if combined_total == 0:
-                    combined_win_percentage = 50
-                else:
-                    combined_win_percentage = (
-                        float(combined_wins) / combined_total
-                    ) * 100
-                simulation_results = run_simulations(
-                    combined_win_percentage, my_race, their_race, SIMULATION_COUNT
-                )
-                distribution = [
-                    int(float(simulation_results[1]) / SIMULATION_COUNT * 100 + 0.5),
-                    int(float(simulation_results[3]) / SIMULATION_COUNT * 100 + 0.5),
-                    int(float(simulation_results[6]) / SIMULATION_COUNT * 100 + 0.5),
-                    int(float(simulation_results[14]) / SIMULATION_COUNT * 100 + 0.5),
-                    int(float(simulation_results[20]) / SIMULATION_COUNT * 100 + 0.5),
+        return "\n\n#### %s %s ####" % (
+            player,
+            " ".join(
+                [
+                    str(record["skill_level"][0]),
+                    str(record["skill_level"][1]),
+                    str(record["skill_level"][2]),
                 ]
-                predictions[player][against][game] = (
-                    (distribution[1] * 3)
-                    + (distribution[2] * 6)
-                    + (distribution[3] * 14)
-                    + (distribution[4] * 20)
-                ) / 100
-                while sum(distribution) < 100:
-                    distribution[3] += 1
-                while sum(distribution) > 100:
-                    distribution[3] -= 1
-                races.append("%s: %s-%s" % (game, my_race, their_race))
-                results["c_loss"].append(game_map[game_index] * distribution[0])
-                results["loss"].append(game_map[game_index] * distribution[1])
-                results["h_loss"].append(game_map[game_index] * distribution[2])
-                results["win"].append(game_map[game_index] * distribution[3])
-                results["c_win"].append(game_map[game_index] * distribution[4])
-                if seed_games[game] < 10:
-                    results["one_line"].append(
-                        game_map[game_index]
-                        + "Not enough results".center(100)
+            ),
+        )
+    except:
+        return None
+
+
+def predict_pairing(player, against, our_record, their_record, simulation_cache):
+    """Predict the points for each game of one pairing and render it
+
+    args:
+      player(str):  our player's name
+      against(str):  their player's name
+      our_record(dict):  our player's record from collect_player
+      their_record(dict):  their player's record from collect_player
+      simulation_cache(simulations.SimulationCache):  cache to simulate through
+
+    returns (prediction(dict), lines(list)):  points by game and the lines
+      to print.  A pairing that can't be predicted stops where it failed.
+    """
+    game_map = {0: "8  ", 1: "9  ", 2: "10 "}
+    prediction = {}
+    lines = []
+    try:
+        seed_games = {"8_ball": 0, "9_ball": 0, "10_ball": 0}
+        results = {}
+        for bucket in ["c_loss", "loss", "h_loss", "win", "c_win", "one_line"]:
+            results.setdefault(bucket, [])
+        game_index = 0
+        races = []
+        for game in ("8_ball", "9_ball", "10_ball"):
+            prediction.setdefault(game, 10)
+            my_race, their_race = get_race(
+                our_record["skill_level"][game_index],
+                their_record["skill_level"][game_index],
+            )
+            skill_difference = my_race - their_race
+            combined_wins = 0
+            combined_losses = 0
+            for spread in [-1, 0, 1]:
+                if (int(skill_difference) + int(spread)) in our_record[game]:
+                    combined_wins = (
+                        combined_wins
+                        + our_record[game][skill_difference + spread]["games_won"]
                     )
-                else:
-                    results["one_line"].append(
-                        game_map[game_index]
-                        + u"\u001b[45;1m"
-                        + str(distribution[0]).center(distribution[0])
-                        + u"\u001b[0m"
-                        + u"\u001b[41;1m"
-                        + str(distribution[1]).center(distribution[1])
-                        + u"\u001b[0m"
-                        + u"\u001b[43;1m"
-                        + str(distribution[2]).center(distribution[2])
-                        + u"\u001b[0m"
-                        + u"\u001b[42;1m"
-                        + str(distribution[3]).center(distribution[3])
-                        + u"\u001b[0m"
-                        + u"\u001b[44;1m"
-                        + str(distribution[4]).center(distribution[4])
-                        + u"\u001b[0m"
+                    combined_losses = (
+                        combined_losses
+                        + our_record[game][skill_difference + spread]["games_lost"]
                     )
+                if ((int(skill_difference) + int(spread)) * -1) in their_record[game]:
+                    combined_wins = (
+                        combined_wins
+                        + their_record[game][(skill_difference + spread) * -1][
+                            "games_lost"
+                        ]
+                    )
+                    combined_losses = (
+                        combined_losses
+                        + their_record[game][(skill_difference + spread) * -1][
+                            "games_won"
+                        ]
+                    )
+            combined_total = combined_wins + combined_losses
+            seed_games[game] = seed_games[game] + combined_total
+            if combined_total == 0:
+                combined_win_percentage = 50
+            else:
+                combined_win_percentage = (float(combined_wins) / combined_total) * 100
+            simulation_results = simulation_cache.run_simulations(
+                combined_win_percentage,
+                my_race,
+                their_race,
+                SIMULATION_COUNT,
+                SIMULATION_METHOD,
+                stream_seed(stream_seed(SEED, player, against), game),
+            )
+            distribution = [
+                int(float(simulation_results[1]) / SIMULATION_COUNT * 100 + 0.5),
+                int(float(simulation_results[3]) / SIMULATION_COUNT * 100 + 0.5),
+                int(float(simulation_results[6]) / SIMULATION_COUNT * 100 + 0.5),
+                int(float(simulation_results[14]) / SIMULATION_COUNT * 100 + 0.5),
+                int(float(simulation_results[20]) / SIMULATION_COUNT * 100 + 0.5),
+            ]
+            prediction[game] = (
+                (distribution[1] * 3)
+                + (distribution[2] * 6)
+                + (distribution[3] * 14)
+                + (distribution[4] * 20)
+            ) / 100
+            while sum(distribution) < 100:
+                distribution[3] += 1
+            while sum(distribution) > 100:
+                distribution[3] -= 1
+            races.append("%s: %s-%s" % (game, my_race, their_race))
+            if "samples" in simulation_results:
+                races[-1] += " (%s races)" % simulation_results["samples"]
+            results["c_loss"].append(game_map[game_index] * distribution[0])
+            results["loss"].append(game_map[game_index] * distribution[1])
+            results["h_loss"].append(game_map[game_index] * distribution[2])
+            results["win"].append(game_map[game_index] * distribution[3])
+            results["c_win"].append(game_map[game_index] * distribution[4])
+            if seed_games[game] < 10:
+                results["one_line"].append(
+                    game_map[game_index] + "Not enough results".center(100)
+                )
+            else:
+                results["one_line"].append(
+                    game_map[game_index]
+                    + u"\u001b[45;1m"
+                    + str(distribution[0]).center(distribution[0])
+                    + u"\u001b[0m"
+                    + u"\u001b[41;1m"
+                    + str(distribution[1]).center(distribution[1])
+                    + u"\u001b[0m"
+                    + u"\u001b[43;1m"
+                    + str(distribution[2]).center(distribution[2])
+                    + u"\u001b[0m"
+                    + u"\u001b[42;1m"
+                    + str(distribution[3]).center(distribution[3])
+                    + u"\u001b[0m"
+                    + u"\u001b[44;1m"
+                    + str(distribution[4]).center(distribution[4])
+                    + u"\u001b[0m"
+                )
 
-                game_index += 1
-            print "%s --- %s --- seed games %s, %s, %s --- skill %s %s %s" % (
+            game_index += 1
+        lines.append(
+            "%s --- %s --- seed games %s, %s, %s --- skill %s %s %s"
+            % (
                 against,
                 ", ".join(races),
                 seed_games["8_ball"],
                 seed_games["9_ball"],
                 seed_games["10_ball"],
-                str(players[OPPONENT][against]["skill_level"][0]),
-                str(players[OPPONENT][against]["skill_level"][1]),
-                str(players[OPPONENT][against]["skill_level"][2]),
+                str(their_record["skill_level"][0]),
+                str(their_record["skill_level"][1]),
+                str(their_record["skill_level"][2]),
             )
-            if GRAPHS == "bucket_per_line":
-                for bucket in ["c_loss", "loss", "h_loss", "win", "c_win"]:
-                    for line in results[bucket]:
-                        print "%s:\t%s" % (bucket, line)
-            elif GRAPHS == "one_line":
-                for line in results["one_line"]:
+        )
+        if GRAPHS == "bucket_per_line":
+            for bucket in ["c_loss", "loss", "h_loss", "win", "c_win"]:
+                for line in results[bucket]:
+                    lines.append("%s:\t%s" % (bucket, line))
+        elif GRAPHS == "one_line":
+            for line in results["one_line"]:
+                lines.append(line)
+        lines.append("-" * 103)
+    except:
+        pass
+    return prediction, lines
+
+
+pool_cache = SimulationCache()
+
+
+def start_simulation_worker(entries):
+    """Give a simulation process the simulation cache values to start from"""
+    global pool_cache
+    reseed()
+    pool_cache = SimulationCache(entries=entries)
+
+
+def simulate_pairing(pairing):
+    """predict_pairing in a simulation process
+
+    args:
+      pairing(tuple):  (player, against, our_record, their_record)
+
+    returns (pairing(tuple), prediction(dict), lines(list), entries(dict),
+      stats(dict)):  (player, against), predict_pairing's prediction and
+      lines, and the simulation cache values and stats gathered for this
+      pairing, to merge
+    """
+    player, against, our_record, their_record = pairing
+    prediction, lines = predict_pairing(
+        player, against, our_record, their_record, pool_cache
+    )
+    entries, stats = pool_cache.changes()
+    return (player, against), prediction, lines, entries, stats
+
+
+def predict_while_collecting(
+    players,
+    teams,
+    scheduler,
+    simulation_cache,
+    previous=None,
+    cache=None,
+    processes=PROCESSES,
+):
+    """Collect players and predict their pairings at the same time
+
+    Each pairing goes to a pool of simulation processes as soon as both of
+    its players are collected, so simulations run while the workers wait on
+    the network, and every pairing is printed under its player's header as
+    it finishes.
+
+    args:
+      players(dict):  rosters from get_rosters, updated in place
+      teams(list):  [our team, their team]
+      scheduler(rate_limit.RequestScheduler):  shared request scheduler
+      simulation_cache(simulations.SimulationCache):  cache to simulate
+        through, the pool's cache values and stats are merged into it
+      previous(dict):  optional players from an earlier run, see collect_players
+      cache(page_cache.PageCache):  optional page cache, see collect_players
+      processes(int):  simulation processes, None for every CPU
+
+    returns:
+      predictions(dict):  {player: {against: prediction}}, only pairings of
+        collected players
+    """
+    us, opponent = teams
+    collected = {us: {}, opponent: {}}
+    lock = threading.Lock()
+    print_lock = threading.Lock()
+    predictions = {}
+
+    def finished(result):
+        # runs on the pool's result thread, one result at a time
+        (player, against), prediction, lines, entries, stats = result
+        simulation_cache.merge(entries, stats)
+        predictions.setdefault(player, {})[against] = prediction
+        # pairings finish in any order, so every one gets its player's header
+        with print_lock:
+            try:
+                header = player_header(player, collected[us][player])
+                if header is not None:
+                    print header
+                for line in lines:
                     print line
-            print "-" * 103
-        except:
-            pass
+            except Exception as error:  # an error here would stop the pool
+                print "Failed to print %s vs %s: %s" % (player, against, error)
+
+    def on_collected(team, player, record):
+        with lock:
+            collected[team][player] = record
+            if team == us:
+                pairings = [(player, against) for against in collected[opponent]]
+            else:
+                pairings = [(ours, player) for ours in collected[us]]
+            for ours, against in pairings:
+                pool.apply_async(
+                    simulate_pairing,
+                    (
+                        (
+                            ours,
+                            against,
+                            collected[us][ours],
+                            collected[opponent][against],
+                        ),
+                    ),
+                    callback=finished,
+                )
+
+    # start the pool before the worker threads, it forks
+    pool = multiprocessing.Pool(
+        processes, start_simulation_worker, (simulation_cache.snapshot(),)
+    )
+    try:
+        collect_players(
+            players,
+            teams,
+            scheduler,
+            previous=previous,
+            cache=cache,
+            on_collected=on_collected,
+        )
+    finally:
+        pool.close()
+        pool.join()
+    return predictions
+
+
+scheduler = RequestScheduler(REQUESTS_PER_SECOND, MAX_REQUESTS_PER_SECOND, retries=RETRIES)
+cache = None
+if CACHE_DIRECTORY is not None:
+    cache = PageCache(CACHE_DIRECTORY, CACHE_TTLS, CACHE_MAX_BYTES)
+browser = open_browser(scheduler, cache)
+players = get_rosters(browser, ROSTERSURL)
+
+storage = Storage(DATABASE)
+previous = {}
+if INCREMENTAL:
+    previous = storage.load_players([US, OPPONENT])
+
+simulation_cache = SimulationCache(SIMULATION_CACHE)
+if PIPELINE:
+    predictions = predict_while_collecting(
+        players, [US, OPPONENT], scheduler, simulation_cache, previous, cache
+    )
+else:
+    collect_players(players, [US, OPPONENT], scheduler, previous=previous, cache=cache)
+print scheduler.report()
+if cache is not None:
+    print cache.report()
+
+storage.save_players(dict((team, players[team]) for team in [US, OPPONENT]))
+if CHECKPOINT is not None and os.path.exists(CHECKPOINT):
+    os.remove(CHECKPOINT)
+
+players = {}
+players = storage.load_players([US, OPPONENT])
+
+if PIPELINE:
+    for player in players[US]:
+        for against in players[OPPONENT]:
+            predictions.setdefault(player, {}).setdefault(against, {})
+else:
+    predictions = {}
+    for player in players[US]:
+        predictions.setdefault(player, {})
+        header = player_header(player, players[US][player])
+        if header is not None:
+            print header
+        for against in players[OPPONENT]:
+            predictions[player][against], lines = predict_pairing(
+                player,
+                against,
+                players[US][player],
+                players[OPPONENT][against],
+                simulation_cache,
+            )
+            for line in lines:
+                print line
 print players
 for against in players[OPPONENT]:
     print "===== %s =====" % against
@@ -492,6 +827,8 @@ for against in players[OPPONENT]:
                 % (player, against, game, predictions[player][against][game])
             )
         print "-----------------------------------"
+simulation_cache.save()
+print simulation_cache.report()
 
 
 
@@ -0,0 +1,109 @@
+#! /usr/bin/python2
+"""Predict every player against every player on the other teams of a division
+
+The (player, against) pairings are split across a process pool and the
+predictions for every ordered pair of teams are saved to the database in
+one transaction, so any two teams can be looked up afterwards with
+Storage.load_predictions without simulating again.
+"""
+
+import multiprocessing
+import time
+
+import history
+from matchups import predict_pool_pairing, start_pool_worker
+from simulations import SimulationCache
+from storage import Storage
+
+TEAMS = None  # None predicts every team in the database
+SIMULATION_COUNT = 5000
+SIMULATION_METHOD = "exact"
+SEED = None  # master seed for monte_carlo and batch, None only draws uncached races
+SIMULATION_CACHE = "simulation_cache.pkl"
+DATABASE = "napa.db"
+PROCESSES = None  # None uses every CPU
+
+
+def division_pairings(players, teams=None):
+    """Get every (team, player, against_team, against, batch_results) between
+    different teams, batch_results is always empty
+    """
+    if teams is None:
+        teams = sorted(players)
+    return [
+        (team, player, against_team, against, {})
+        for team in teams
+        for against_team in teams
+        if against_team != team
+        for player in players[team]
+        for against in players[against_team]
+    ]
+
+
+def predict_division(players, teams=None, processes=PROCESSES, simulation_cache=None):
+    """Predict every pairing of players on different teams
+
+    args:
+      players(dict):  {team: {name: history.PlayerHistory}}
+      teams(list):  team names to predict, None for every team in players
+      processes(int):  pool size, None for every CPU
+      simulation_cache(simulations.SimulationCache):  optional, the workers
+        start from its values and what they simulate is merged back into it
+
+    returns:
+      matrix(dict):  {(team, against_team): {player: {against: prediction}}}
+    """
+    pairings = division_pairings(players, teams)
+    if simulation_cache is None:
+        simulation_cache = SimulationCache()
+    pool = multiprocessing.Pool(
+        processes,
+        start_pool_worker,
+        (
+            players,
+            simulation_cache.snapshot(),
+            SIMULATION_COUNT,
+            SIMULATION_METHOD,
+            "one_line",
+            SEED,
+        ),
+    )
+    try:
+        workers = processes or multiprocessing.cpu_count()
+        chunksize = max(1, len(pairings) // (4 * workers))
+        results = pool.imap(predict_pool_pairing, pairings, chunksize)
+        matrix = {}
+        for pairing, (prediction, lines, entries, stats) in zip(pairings, results):
+            team, player, against_team, against = pairing[:4]
+            simulation_cache.merge(entries, stats)
+            matrix.setdefault((team, against_team), {}).setdefault(player, {})[
+                against
+            ] = prediction
+    finally:
+        pool.close()
+        pool.join()
+    return matrix
+
+
+if __name__ == "__main__":
+    storage = Storage(DATABASE)
+    division = history.from_players(storage.load_players(TEAMS))
+    simulation_cache = SimulationCache(SIMULATION_CACHE)
+    start = time.time()
+    matrix = predict_division(division, TEAMS, simulation_cache=simulation_cache)
+    storage.save_prediction_matrix(matrix)
+    storage.close()
+    simulation_cache.save()
+    print (
+        "%s pairings across %s teams in %.1fs"
+        % (
+            sum(
+                len(predictions[player])
+                for predictions in matrix.values()
+                for player in predictions
+            ),
+            len(division),
+            time.time() - start,
+        )
+    )
+    print simulation_cache.report()
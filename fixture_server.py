@@ -0,0 +1,111 @@
+#! /usr/bin/python2
+"""Serve captured NAPA pages from a local directory
+
+Pages saved with save_fixture (HttpBrowser does this with a
+capture_directory) are served back for the same path and query, so the
+scraper can be tested and benchmarked offline by pointing SITE in
+collect_data.py at http://127.0.0.1:<port>.
+
+    python fixture_server.py <fixture directory> [port] [delay seconds] [failure rate]
+"""
+
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit
+
+PORT = 8000
+
+
+def fixture_name(url):
+    """Get the fixture file name for a URL, only the path and query matter"""
+    parts = urlsplit(url)
+    page = parts.path.lstrip("/")
+    if parts.query:
+        page = "%s?%s" % (page, parts.query)
+    return "%s.html" % re.sub(r"[^A-Za-z0-9.=-]+", "_", page)
+
+
+def save_fixture(directory, url, source):
+    """Save page source as the fixture for a URL"""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(os.path.join(directory, fixture_name(url)), "wb") as fixture:
+        fixture.write(source.encode("utf-8"))
+
+
+class FixtureServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, directory, port=PORT, delay=0.0, failure_rate=0.0):
+        HTTPServer.__init__(self, ("127.0.0.1", port), FixtureHandler)
+        self.directory = directory
+        self.delay = delay
+        self.failure_rate = failure_rate
+        self.requests = 0
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests += 1
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        if random.random() < self.server.failure_rate:
+            self.send_error(503, "Simulated failure")
+            return
+        path = os.path.join(self.server.directory, fixture_name(self.path))
+        if not os.path.exists(path):
+            self.send_error(404, "No fixture %s" % fixture_name(self.path))
+            return
+        with open(path, "rb") as fixture:
+            body = fixture.read()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(directory, port=PORT, delay=0.0, failure_rate=0.0):
+    """Start a fixture server in a background thread
+
+    args:
+      directory(str):  directory of saved fixtures
+      port(int):  port on 127.0.0.1, 0 picks a free port
+      delay(float):  seconds to wait before each response, to mimic the site
+      failure_rate(float):  share of requests answered with a 503
+
+    returns:
+      server(FixtureServer):  server.server_address has the port, call
+        server.shutdown() to stop it
+    """
+    server = FixtureServer(directory, port, delay, failure_rate)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    server = FixtureServer(
+        sys.argv[1],
+        int(sys.argv[2]) if len(sys.argv) > 2 else PORT,
+        float(sys.argv[3]) if len(sys.argv) > 3 else 0.0,
+        float(sys.argv[4]) if len(sys.argv) > 4 else 0.0,
+    )
+    print("Serving %s on http://127.0.0.1:%s" % (sys.argv[1], server.server_address[1]))
+    server.serve_forever()
@@ -1,7 +1,17 @@
 #! /usr/bin/python2
 
-import pickle
 import itertools
+import time
+
+from lineups import branch_and_bound, solve_put_up, top_lineups
+from storage import Storage
+
+OPPONENT = "Rack And Run"
+US = "Zoosters Millions"
+DATABASE = "napa.db"
+TOP_LINEUPS = 3
+SEARCH_SECONDS = 5.0
+EXHAUSTIVE_LINEUP_LIMIT = 1000000
 
 
 def available_players(team):
@@ -59,24 +69,35 @@ def member_availability(our_team, their_team):
     return our_team, their_team
 
 
-def remove_duplicate_play(all_permutations_team_duplicate_play):
-    all_permutations_team = []
-    counter = 0
-    for set in all_permutations_team_duplicate_play:
-        counter += 1
-        skip = False
-        us_found = []
-        them_found = []
-        for subset in set:
-            if any((subset[0] in us_found, subset[1] in them_found)):
-                skip = True
-            else:
-                us_found.append(subset[0])
-                them_found.append(subset[1])
-        if not skip:
-            all_permutations_team.append(set)
-    print (counter, len(all_permutations_team))
-    return all_permutations_team
+def valid_lineups(
+    our_players, their_players, games_remaining, our_first=None, their_first=None
+):
+    """Generate lineups where no player appears twice
+
+    Lineups are built from permutations of each team, so only valid lineups
+    are ever created and they are yielded one at a time.
+
+    args:
+      our_players(list): our player indexes
+      their_players(list): their player indexes
+      games_remaining(int): number of (us, them) pairs per lineup
+      our_first(int): optional our player in the first game
+      their_first(int): optional their player in the first game
+
+    yields:
+      lineup(tuple): ((us, them), ...) one pair per game
+    """
+    if games_remaining < 1:
+        return
+    for player in our_players if our_first is None else [our_first]:
+        for opponent in their_players if their_first is None else [their_first]:
+            our_rest = [index for index in our_players if index != player]
+            their_rest = [index for index in their_players if index != opponent]
+            for our_order in itertools.permutations(our_rest, games_remaining - 1):
+                for their_order in itertools.permutations(
+                    their_rest, games_remaining - 1
+                ):
+                    yield ((player, opponent),) + tuple(zip(our_order, their_order))
 
 
 def best_scenario(games_remaining, our_available, their_available, their_pick=None):
@@ -94,16 +115,11 @@ def best_scenario(games_remaining, our_available, their_available, their_pick=No
     us = {k: v for k, v in enumerate(our_available)}
     them = {k: v for k, v in enumerate(their_available)}
     all_permutations_individual = {}
-    all_permutations_team = []
     for player in us:
         for opponent in them:
             all_permutations_individual[(player, opponent)] = predictions[us[player]][
                 them[opponent]
             ]["combined"]
-    all_permutations_team_duplicate_play = itertools.permutations(
-        all_permutations_individual.keys(), games_remaining
-    )
-    all_permutations_team = remove_duplicate_play(all_permutations_team_duplicate_play)
 
     if not their_pick:
         picks = {}
@@ -112,15 +128,14 @@ def best_scenario(games_remaining, our_available, their_available, their_pick=No
             this_match_total = 0
             player_count = 0
             player_total = 0
-            for set in all_permutations_team:
-                if player == set[0][0]:
-                    if all_permutations_individual[set[0]]:
-                        this_match_count += 1
-                        this_match_total += float(all_permutations_individual[set[0]])
-                    for subset in set[1:]:
-                        if all_permutations_individual[subset]:
-                            player_count += 1
-                            player_total += float(all_permutations_individual[subset])
+            for set in valid_lineups(list(us), list(them), games_remaining, player):
+                if all_permutations_individual[set[0]]:
+                    this_match_count += 1
+                    this_match_total += float(all_permutations_individual[set[0]])
+                for subset in set[1:]:
+                    if all_permutations_individual[subset]:
+                        player_count += 1
+                        player_total += float(all_permutations_individual[subset])
             player_count = max(1, player_count)
             this_match_count = max(1, this_match_count)
             predicted_score = (this_match_total / this_match_count) + (
@@ -144,15 +159,16 @@ def best_scenario(games_remaining, our_available, their_available, their_pick=No
             this_match_total = 0
             player_count = 0
             player_total = 0
-            for set in all_permutations_team:
-                if all((player == set[0][0], they_picked == set[0][1])):
-                    if all_permutations_individual[set[0]]:
-                        this_match_count += 1
-                        this_match_total += float(all_permutations_individual[set[0]])
-                    for subset in set[1:]:
-                        if all_permutations_individual[subset]:
-                            player_count += 1
-                            player_total += float(all_permutations_individual[subset])
+            for set in valid_lineups(
+                list(us), list(them), games_remaining, player, they_picked
+            ):
+                if all_permutations_individual[set[0]]:
+                    this_match_count += 1
+                    this_match_total += float(all_permutations_individual[set[0]])
+                for subset in set[1:]:
+                    if all_permutations_individual[subset]:
+                        player_count += 1
+                        player_total += float(all_permutations_individual[subset])
             player_count = max(1, player_count)
             this_match_count = max(1, this_match_count)
             predicted_score = (this_match_total / this_match_count) + (
@@ -168,8 +184,174 @@ def best_scenario(games_remaining, our_available, their_available, their_pick=No
             print picks[k], k
 
 
-data_file = open("predictions.pkl", "rb")
-predictions = pickle.load(data_file)
+def matchup_scores(our_available, their_available):
+    """Get predicted combined scores indexed [our player][their player]
+
+    args:
+      our_available(list): our available players
+      their_available(list): their available players
+
+    returns scores(list): list of lists of floats, missing predictions are 0
+    """
+    scores = []
+    for player in our_available:
+        row = []
+        for opponent in their_available:
+            combined = predictions[player][opponent]["combined"]
+            row.append(float(combined) if combined else 0.0)
+        scores.append(row)
+    return scores
+
+
+def minimax_scenario(games_remaining, our_available, their_available, their_pick=None):
+    """Get best pick assuming both teams pick their best for every game
+
+    args:
+      games_remaining(int): number of games remaining
+      our_available(list): our available players
+      their_available(list): their available players
+      their_pick (str): optional their pick
+
+    returns:
+      (best pick (str), expected score (float)) for the next games_remaining
+        games, (None, 0.0) when no games remain or either team has no one left
+    """
+    if games_remaining <= 0 or not our_available or not their_available:
+        return None, 0.0
+    scores = matchup_scores(our_available, their_available)
+    our_mask = (1 << len(our_available)) - 1
+    their_mask = (1 << len(their_available)) - 1
+    memo = {}
+    picks = {}
+    for i, player in enumerate(our_available):
+        if not their_pick:
+            responses = range(len(their_available))
+        else:
+            responses = [their_available.index(their_pick)]
+        picks[player] = min(
+            scores[i][j]
+            + solve_put_up(
+                scores,
+                games_remaining - 1,
+                our_mask & ~(1 << i),
+                their_mask & ~(1 << j),
+                bool(their_pick),
+                memo,
+            )
+            for j in responses
+        )
+    if not their_pick:
+        print (
+            "===== minimax blind selections:  expect score for next %s games ====="
+            % games_remaining
+        )
+    else:
+        print (
+            "===== minimax player against %s expect score for next %s games ====="
+            % (their_pick, games_remaining)
+        )
+    for player in sorted(picks, key=picks.get, reverse=True):
+        print player, round(picks[player], 2)
+    best_pick = max(picks, key=picks.get)
+    return best_pick, picks[best_pick]
+
+
+def best_lineups(
+    games_remaining, our_available, their_available, their_pick=None, top_k=TOP_LINEUPS
+):
+    """Get the lineups with the highest total predicted score
+
+    Solves the assignment problem instead of scoring every lineup, see
+    lineups.top_lineups.
+
+    args:
+      games_remaining(int): number of games remaining
+      our_available(list): our available players
+      their_available(list): their available players
+      their_pick (str): optional their pick, lineups must include them
+      top_k(int): number of lineups
+
+    returns:
+      lineups(list): (total(float), [(our player, their player), ...]) best first
+    """
+    their_required = None
+    if their_pick:
+        their_required = their_available.index(their_pick)
+    lineups = [
+        (total, [(our_available[i], their_available[j]) for i, j in pairs])
+        for total, pairs in top_lineups(
+            matchup_scores(our_available, their_available),
+            games_remaining,
+            top_k,
+            their_required,
+        )
+    ]
+    print (
+        "===== best lineups:  total score for next %s games =====" % games_remaining
+    )
+    for total, lineup in lineups:
+        print round(total, 2), ", ".join(
+            "%s vs %s" % (player, opponent) for player, opponent in lineup
+        )
+    return lineups
+
+
+def lineup_count(games_remaining, our_available, their_available):
+    """Get the number of lineups best_scenario scores"""
+    count = 1
+    for game in range(games_remaining):
+        count *= max(0, len(our_available) - game) * max(0, len(their_available) - game)
+    return count
+
+
+def branch_and_bound_lineup(
+    games_remaining, our_available, their_available, their_pick=None, budget=SEARCH_SECONDS
+):
+    """Search for the highest scoring lineup within a time budget
+
+    See lineups.branch_and_bound.
+
+    args:
+      games_remaining(int): number of games remaining
+      our_available(list): our available players
+      their_available(list): their available players
+      their_pick (str): optional their pick, the lineup must include them
+      budget(float): seconds to search
+
+    returns:
+      (total(float), lineup(list), proven(bool)) lineup is
+      [(our player, their player), ...], proven is False when the budget ran
+      out before the search finished
+    """
+    their_required = None
+    if their_pick:
+        their_required = their_available.index(their_pick)
+    start = time.time()
+    total, pairs, proven = branch_and_bound(
+        matchup_scores(our_available, their_available),
+        games_remaining,
+        their_required,
+        budget,
+    )
+    lineup = [(our_available[i], their_available[j]) for i, j in pairs]
+    if proven:
+        status = "proven best"
+    else:
+        status = "best found in %.1fs" % (time.time() - start)
+    print (
+        "===== branch and bound lineup:  total score for next %s games (%s) ====="
+        % (games_remaining, status)
+    )
+    if total is not None:
+        print round(total, 2), ", ".join(
+            "%s vs %s" % (player, opponent) for player, opponent in lineup
+        )
+    return total, lineup, proven
+
+
+storage = Storage(DATABASE)
+predictions = storage.load_predictions(US, OPPONENT)
+storage.close()
 
 
 our_team = {}
@@ -196,8 +378,24 @@ for i in range(int(games_remaining), 0, -1):
     print ("==================================")
     print ("%s games remaining" % str(i))
     our_team, their_team = member_availability(our_team, their_team)
+    exhaustive = (
+        lineup_count(i, available_players(our_team), available_players(their_team))
+        <= EXHAUSTIVE_LINEUP_LIMIT
+    )
+    if not exhaustive:
+        print ("Too many lineups to score them all, skipping best_scenario")
     if int(put_up) == 1:
-        best_scenario(i, available_players(our_team), available_players(their_team))
+        if exhaustive:
+            best_scenario(
+                i, available_players(our_team), available_players(their_team)
+            )
+        minimax_scenario(
+            i, available_players(our_team), available_players(their_team)
+        )
+        best_lineups(i, available_players(our_team), available_players(their_team))
+        branch_and_bound_lineup(
+            i, available_players(our_team), available_players(their_team)
+        )
         put_up = 2
     else:
         print ("Their selection")
@@ -206,7 +404,26 @@ for i in range(int(games_remaining), 0, -1):
                 "%s: %s (%s)" % (str(index), their_team[index][0], their_team[index][1])
             )
         their_player = raw_input(">  ")
-        best_scenario(
+        if exhaustive:
+            best_scenario(
+                i,
+                available_players(our_team),
+                available_players(their_team),
+                their_team[int(their_player)][0],
+            )
+        minimax_scenario(
+            i,
+            available_players(our_team),
+            available_players(their_team),
+            their_team[int(their_player)][0],
+        )
+        best_lineups(
+            i,
+            available_players(our_team),
+            available_players(their_team),
+            their_team[int(their_player)][0],
+        )
+        branch_and_bound_lineup(
             i,
             available_players(our_team),
             available_players(their_team),
@@ -0,0 +1,195 @@
+"""Compact player histories
+
+A player's games won and lost by skill difference are kept in one flat
+integer array per game instead of a dict of dicts:
+
+    counts[2 * (offset + skill_diff)]      games won
+    counts[2 * (offset + skill_diff) + 1]  games lost
+
+A running total of the same array answers the games won and lost over any
+range of skill differences with two lookups.
+
+Player records use __slots__ and convert both ways with the dict records
+collect_data.py and storage use.
+"""
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+GAMES = ("8_ball", "9_ball", "10_ball")
+SPAN = 8  # largest difference between two races, arrays cover -SPAN to SPAN
+
+
+class GameHistory(object):
+    """Games won and lost by skill difference for one game
+
+    args:
+      offset(int):  index of skill difference 0, the array covers -offset
+        to offset
+      counts(array):  games won and lost, two ints per skill difference
+      present(int):  bit per skill difference that had an entry in the
+        dict format, so empty entries survive a round trip
+
+    sums holds the running totals of counts: games won and lost below each
+    index, built once so counts must not change afterwards.
+    """
+
+    __slots__ = ("offset", "counts", "present", "sums")
+
+    def __init__(self, offset=SPAN, counts=None, present=0):
+        self.offset = offset
+        if counts is None:
+            counts = array("i", [0]) * (2 * (2 * offset + 1))
+        self.counts = counts
+        self.present = present
+        self.sums = array("l", [0, 0])
+        for index in range(0, len(counts), 2):
+            self.sums.append(self.sums[index] + counts[index])
+            self.sums.append(self.sums[index + 1] + counts[index + 1])
+
+    @classmethod
+    def from_dict(cls, results):
+        """Build from {skill_diff: {"games_won": n, "games_lost": m}}"""
+        offset = max([SPAN] + [abs(skill_diff) for skill_diff in results])
+        counts = array("i", [0]) * (2 * (2 * offset + 1))
+        present = 0
+        for skill_diff, games in results.items():
+            index = offset + skill_diff
+            counts[2 * index] = games["games_won"]
+            counts[2 * index + 1] = games["games_lost"]
+            present |= 1 << index
+        return cls(offset, counts, present)
+
+    def to_dict(self):
+        """Get {skill_diff: {"games_won": n, "games_lost": m}}"""
+        results = {}
+        for index in range(2 * self.offset + 1):
+            if self.present >> index & 1:
+                results[index - self.offset] = {
+                    "games_won": self.counts[2 * index],
+                    "games_lost": self.counts[2 * index + 1],
+                }
+        return results
+
+    def window(self, low, high):
+        """Get (games_won, games_lost) over skill differences low to high"""
+        start = min(max(low + self.offset, 0), 2 * self.offset + 1)
+        end = min(max(high + self.offset + 1, 0), 2 * self.offset + 1)
+        return (
+            self.sums[2 * end] - self.sums[2 * start],
+            self.sums[2 * end + 1] - self.sums[2 * start + 1],
+        )
+
+    def games_played(self):
+        """Get the number of games won and lost at every skill difference"""
+        end = 2 * (2 * self.offset + 1)
+        return self.sums[end] + self.sums[end + 1]
+
+
+class PlayerHistory(object):
+    """A player record with a GameHistory per game
+
+    Reading record["skill_level"], record["8_ball"] and so on works like
+    the dict format, and raises KeyError for a player that was never
+    collected.
+    """
+
+    __slots__ = ("player_id", "collected", "skill_level", "games", "watermarks")
+
+    def __init__(
+        self, player_id, collected=False, skill_level=None, games=None, watermarks=None
+    ):
+        self.player_id = player_id
+        self.collected = collected
+        self.skill_level = skill_level
+        self.games = games
+        self.watermarks = watermarks
+
+    @classmethod
+    def from_record(cls, record):
+        """Build from a dict player record"""
+        if "skill_level" not in record:
+            return cls(record.get("player_id"))
+        return cls(
+            record.get("player_id"),
+            True,
+            record["skill_level"],
+            tuple(GameHistory.from_dict(record[game]) for game in GAMES),
+            record.get("watermarks"),
+        )
+
+    def to_record(self):
+        """Get the dict player record"""
+        record = {"player_id": self.player_id}
+        if not self.collected:
+            return record
+        record["skill_level"] = self.skill_level
+        for game, history in zip(GAMES, self.games):
+            record[game] = history.to_dict()
+        if self.watermarks is not None:
+            record["watermarks"] = self.watermarks
+        return record
+
+    def __getitem__(self, key):
+        if key == "player_id":
+            return self.player_id
+        if self.collected:
+            if key == "skill_level":
+                return self.skill_level
+            if key in GAMES:
+                return self.games[GAMES.index(key)]
+            if key == "watermarks" and self.watermarks is not None:
+                return self.watermarks
+        raise KeyError(key)
+
+
+def stack_sums(histories, offset=None):
+    """Get the running totals of several histories as one numpy array
+
+    args:
+      histories(list):  GameHistory per player
+      offset(int):  common offset, at least every history's offset, default
+        the largest
+
+    returns (offset(int), sums(numpy.ndarray)):  sums[player, index] is
+      (games won, games lost) below skill difference index - offset
+    """
+    if numpy is None:
+        raise ImportError("numpy is required for stacked histories")
+    if offset is None:
+        offset = max([SPAN] + [history.offset for history in histories])
+    counts = numpy.zeros((len(histories), 2 * offset + 1, 2), dtype=numpy.int64)
+    for row, history in enumerate(histories):
+        start = offset - history.offset
+        counts[row, start : start + 2 * history.offset + 1] = numpy.frombuffer(
+            history.counts, dtype=numpy.intc
+        ).reshape(-1, 2)
+    sums = numpy.zeros((len(histories), 2 * offset + 2, 2), dtype=numpy.int64)
+    numpy.cumsum(counts, axis=1, out=sums[:, 1:])
+    return offset, sums
+
+
+def from_players(players):
+    """Convert {team: {name: record}} to PlayerHistory records"""
+    return dict(
+        (
+            team,
+            dict(
+                (name, PlayerHistory.from_record(record))
+                for name, record in roster.items()
+            ),
+        )
+        for team, roster in players.items()
+    )
+
+
+def to_players(histories):
+    """Convert {team: {name: PlayerHistory}} back to dict records"""
+    return dict(
+        (team, dict((name, history.to_record()) for name, history in roster.items()))
+        for team, roster in histories.items()
+    )
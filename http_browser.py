@@ -0,0 +1,54 @@
+"""Fetch NAPA pages over plain HTTP instead of driving a browser
+
+The roster and stats pages are plain HTML, so a pooled requests session and
+stat_pages parse them without browser startup, javascript rendering or
+implicit waits.
+"""
+
+try:
+    import requests
+    from requests.adapters import HTTPAdapter
+except ImportError:
+    requests = None
+
+import fixture_server
+
+
+class HttpBrowser(object):
+    """The part of the selenium webdriver interface the scraper uses
+
+    Only works with parser="page_source": get() fetches a page and stores its
+    HTML in page_source.
+
+    args:
+      timeout(float):  seconds to wait for each response
+      pool_size(int):  connections kept open per host
+      capture_directory(str):  optional directory to save every page to as a
+        fixture for fixture_server
+    """
+
+    def __init__(self, timeout=10, pool_size=10, capture_directory=None):
+        if requests is None:
+            raise ImportError("requests is required for the http backend")
+        self.timeout = timeout
+        self.capture_directory = capture_directory
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.current_url = None
+        self.page_source = ""
+
+    def get(self, url):
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        self.current_url = url
+        self.page_source = response.text
+        if self.capture_directory is not None:
+            fixture_server.save_fixture(self.capture_directory, url, self.page_source)
+
+    def implicitly_wait(self, seconds):
+        pass  # the page is complete once get() returns
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,392 @@
+"""Find the best lineups for the rest of a match
+
+The solvers work on a scores matrix, scores[i][j] being the predicted score
+of our player i against their player j (see game_time.matchup_scores), and
+on player indexes into it.  game_time.py names the players and prints.
+
+Check every solver against brute force on random rosters with
+
+    python lineups.py [trials]
+"""
+
+import heapq
+import itertools
+import random
+import sys
+import time
+
+FORBIDDEN = 1e9
+
+
+def solve_put_up(scores, games_remaining, our_mask, their_mask, we_put_up, memo):
+    """Get our expected score for the remaining games with both teams picking their best
+
+    The team putting up picks first, the other team responds, and put up
+    alternates every game.  We maximize our score and they minimize it.
+    States are keyed by bitmasks of the players still available so each one
+    is solved once.
+
+    args:
+      scores(list): scores[our player][their player]
+      games_remaining(int): number of games remaining
+      our_mask(int): bit i set while our player i is available
+      their_mask(int): bit j set while their player j is available
+      we_put_up(bool): True when we pick first this game
+      memo(dict): solved states
+
+    returns value(float): expected score for the remaining games
+    """
+    if games_remaining <= 0:
+        return 0.0
+    key = (our_mask, their_mask, games_remaining, we_put_up)
+    if key in memo:
+        return memo[key]
+    ours = [i for i in range(len(scores)) if our_mask & (1 << i)]
+    theirs = [j for j in range(len(scores[0])) if their_mask & (1 << j)]
+    if not ours or not theirs:
+        return 0.0
+    first, second = (ours, theirs) if we_put_up else (theirs, ours)
+    best = None
+    for pick in first:
+        response_value = None
+        for response in second:
+            i, j = (pick, response) if we_put_up else (response, pick)
+            value = scores[i][j] + solve_put_up(
+                scores,
+                games_remaining - 1,
+                our_mask & ~(1 << i),
+                their_mask & ~(1 << j),
+                not we_put_up,
+                memo,
+            )
+            if response_value is None or (
+                value < response_value if we_put_up else value > response_value
+            ):
+                response_value = value
+                if best is not None and (
+                    response_value <= best if we_put_up else response_value >= best
+                ):
+                    break  # this pick can no longer beat the best one
+        if best is None or (response_value > best if we_put_up else response_value < best):
+            best = response_value
+    memo[key] = best
+    return best
+
+
+def hungarian(cost):
+    """Get the minimum cost assignment of every row to a different column
+
+    args:
+      cost(list): square list of lists of costs
+
+    returns assignment(list): column index for each row
+    """
+    size = len(cost)
+    row_potential = [0.0] * (size + 1)
+    column_potential = [0.0] * (size + 1)
+    column_row = [0] * (size + 1)
+    way = [0] * (size + 1)
+    for row in range(1, size + 1):
+        column_row[0] = row
+        column = 0
+        minimum = [float("inf")] * (size + 1)
+        used = [False] * (size + 1)
+        while True:
+            used[column] = True
+            current_row = column_row[column]
+            delta = float("inf")
+            next_column = 0
+            for j in range(1, size + 1):
+                if not used[j]:
+                    reduced = (
+                        cost[current_row - 1][j - 1]
+                        - row_potential[current_row]
+                        - column_potential[j]
+                    )
+                    if reduced < minimum[j]:
+                        minimum[j] = reduced
+                        way[j] = column
+                    if minimum[j] < delta:
+                        delta = minimum[j]
+                        next_column = j
+            for j in range(0, size + 1):
+                if used[j]:
+                    row_potential[column_row[j]] += delta
+                    column_potential[j] -= delta
+                else:
+                    minimum[j] -= delta
+            column = next_column
+            if column_row[column] == 0:
+                break
+        while column:
+            previous_column = way[column]
+            column_row[column] = column_row[previous_column]
+            column = previous_column
+    assignment = [None] * size
+    for j in range(1, size + 1):
+        assignment[column_row[j] - 1] = j - 1
+    return assignment
+
+
+def best_assignment(scores, games, included, excluded, their_required=None):
+    """Get the highest scoring lineup of games pairs under constraints
+
+    The lineup is an assignment problem padded with sit-out rows and columns
+    so that exactly games pairs are real matchups.
+
+    args:
+      scores(list): scores[our player][their player]
+      games(int): number of pairs in the lineup
+      included(tuple): (us, them) index pairs that must be played
+      excluded(set): (us, them) index pairs that can not be played
+      their_required(int): optional their player that must play
+
+    returns (total(float), pairs(tuple)) or None when no lineup fits
+    """
+    ours = [i for i in range(len(scores)) if i not in [pair[0] for pair in included]]
+    theirs = [
+        j for j in range(len(scores[0])) if j not in [pair[1] for pair in included]
+    ]
+    total = sum(scores[i][j] for i, j in included)
+    games = games - len(included)
+    if games == 0:
+        return total, tuple(sorted(included))
+    if games > min(len(ours), len(theirs)):
+        return None
+    size = len(ours) + len(theirs) - games
+    cost = []
+    for row in range(size):
+        cost_row = []
+        for column in range(size):
+            if row < len(ours) and column < len(theirs):
+                if (ours[row], theirs[column]) in excluded:
+                    cost_row.append(FORBIDDEN)
+                else:
+                    cost_row.append(-scores[ours[row]][theirs[column]])
+            elif row < len(ours) or column < len(theirs):
+                if row >= len(ours) and theirs[column] == their_required:
+                    cost_row.append(FORBIDDEN)
+                else:
+                    cost_row.append(0.0)  # sits out
+            else:
+                cost_row.append(FORBIDDEN)
+        cost.append(cost_row)
+    assignment = hungarian(cost)
+    if any(cost[row][column] >= FORBIDDEN for row, column in enumerate(assignment)):
+        return None
+    pairs = list(included)
+    for row, column in enumerate(assignment):
+        if row < len(ours) and column < len(theirs):
+            pairs.append((ours[row], theirs[column]))
+            total += scores[ours[row]][theirs[column]]
+    return total, tuple(sorted(pairs))
+
+def top_lineups(scores, games, top_k, their_required=None):
+    """Get the lineups of games pairs with the highest total score
+
+    Solves the assignment problem instead of scoring every lineup, then
+    partitions the remaining lineups around each answer (Murty's method)
+    to find the next best ones.
+
+    args:
+      scores(list): scores[our player][their player]
+      games(int): number of pairs in a lineup
+      top_k(int): number of lineups
+      their_required(int): optional their player every lineup must include
+
+    returns lineups(list): (total(float), pairs(tuple)) best first, pairs
+      are sorted (us, them) index pairs
+    """
+    lineups = []
+    candidates = []
+    solution = best_assignment(scores, games, (), frozenset(), their_required)
+    if solution is not None:
+        heapq.heappush(candidates, (-solution[0], solution[1], (), frozenset()))
+    while candidates and len(lineups) < top_k:
+        total, pairs, included, excluded = heapq.heappop(candidates)
+        lineups.append((-total, pairs))
+        free = [pair for pair in pairs if pair not in included]
+        for index, pair in enumerate(free):
+            sub_included = included + tuple(free[:index])
+            sub_excluded = excluded | frozenset([pair])
+            solution = best_assignment(
+                scores, games, sub_included, sub_excluded, their_required
+            )
+            if solution is not None:
+                heapq.heappush(
+                    candidates,
+                    (-solution[0], solution[1], sub_included, sub_excluded),
+                )
+    return lineups
+
+
+def branch_and_bound(scores, games, their_required=None, budget=5.0):
+    """Search for the highest scoring lineup within a time budget
+
+    Our players are placed best first against each of their players or sat
+    out.  A branch is pruned when its score plus the best prediction of each
+    remaining player can not beat the best lineup found so far.
+
+    args:
+      scores(list): scores[our player][their player]
+      games(int): number of pairs in the lineup
+      their_required(int): optional their player the lineup must include
+      budget(float): seconds to search
+
+    returns (total(float), pairs(list), proven(bool)):  total is None when
+      no lineup was found, pairs are sorted (us, them) index pairs, proven
+      is False when the budget ran out before the search finished
+    """
+    order = sorted(
+        range(len(scores)), key=lambda i: max(scores[i] or [0]), reverse=True
+    )
+    their_count = len(scores[0]) if scores else 0
+    deadline = time.time() + budget
+    search = {"total": None, "pairs": None, "nodes": 0, "timed_out": False}
+
+    def branch(position, games_left, used, total, pairs):
+        search["nodes"] += 1
+        if search["nodes"] % 1000 == 0 and time.time() > deadline:
+            search["timed_out"] = True
+        if search["timed_out"]:
+            return
+        if games_left == 0:
+            if their_required is None or their_required in used:
+                if search["total"] is None or total > search["total"]:
+                    search["total"] = total
+                    search["pairs"] = pairs
+            return
+        unused = [j for j in range(their_count) if j not in used]
+        remaining = order[position:]
+        if len(remaining) < games_left or len(unused) < games_left:
+            return
+        optimistic = sorted(
+            [max(scores[i][j] for j in unused) for i in remaining], reverse=True
+        )
+        if search["total"] is not None and (
+            total + sum(optimistic[:games_left]) <= search["total"]
+        ):
+            return
+        player = order[position]
+        for opponent in sorted(unused, key=lambda j: scores[player][j], reverse=True):
+            branch(
+                position + 1,
+                games_left - 1,
+                used | frozenset([opponent]),
+                total + scores[player][opponent],
+                pairs + [(player, opponent)],
+            )
+        if len(remaining) > games_left:  # player sits out
+            branch(position + 1, games_left, used, total, pairs)
+
+    branch(0, games, frozenset(), 0.0, [])
+    return search["total"], sorted(search["pairs"] or []), not search["timed_out"]
+
+
+def brute_force_lineups(scores, games, their_required=None):
+    """Score every lineup, best first, like top_lineups returns them"""
+    lineups = []
+    for ours in itertools.combinations(range(len(scores)), games):
+        for theirs in itertools.permutations(range(len(scores[0])), games):
+            if their_required is not None and their_required not in theirs:
+                continue
+            pairs = tuple(zip(ours, theirs))
+            lineups.append((sum(scores[i][j] for i, j in pairs), pairs))
+    return sorted(lineups, reverse=True)
+
+
+def brute_force_put_up(scores, games_remaining, ours, theirs, we_put_up):
+    """solve_put_up without the memo, bitmasks or pruning"""
+    if games_remaining <= 0 or not ours or not theirs:
+        return 0.0
+    first, second = (ours, theirs) if we_put_up else (theirs, ours)
+    values = []
+    for pick in first:
+        responses = []
+        for response in second:
+            i, j = (pick, response) if we_put_up else (response, pick)
+            responses.append(
+                scores[i][j]
+                + brute_force_put_up(
+                    scores,
+                    games_remaining - 1,
+                    ours - set([i]),
+                    theirs - set([j]),
+                    not we_put_up,
+                )
+            )
+        values.append(min(responses) if we_put_up else max(responses))
+    return max(values) if we_put_up else min(values)
+
+
+def random_scores(generator, our_count, their_count):
+    """Get scores like matchup_scores', with ties and missing predictions"""
+    return [
+        [
+            0.0 if generator.random() < 0.1 else generator.choice(range(5, 21)) / 1.0
+            for j in range(their_count)
+        ]
+        for i in range(our_count)
+    ]
+
+
+def check(trials=200, seed=0):
+    """Check the solvers against brute force on random rosters
+
+    raises AssertionError naming the solver, scores and settings that failed
+    """
+    generator = random.Random(seed)
+    for trial in range(trials):
+        our_count = generator.randint(1, 6)
+        their_count = generator.randint(1, 6)
+        scores = random_scores(generator, our_count, their_count)
+        games = generator.randint(1, min(our_count, their_count))
+        their_required = generator.choice([None] + list(range(their_count)))
+        settings = (scores, games, their_required)
+
+        expected = brute_force_lineups(scores, games, their_required)
+        top_k = generator.randint(1, 5)
+        lineups = top_lineups(scores, games, top_k, their_required)
+        totals = [round(total, 6) for total, pairs in lineups]
+        if totals != [round(total, 6) for total, pairs in expected[:top_k]]:
+            raise AssertionError("top_lineups %s for %s" % (lineups, settings))
+        if len(set(pairs for total, pairs in lineups)) != len(lineups):
+            raise AssertionError("top_lineups repeated a lineup for %s" % (settings,))
+        for total, pairs in lineups:
+            valid = (
+                len(pairs) == games
+                and len(set(i for i, j in pairs)) == games
+                and len(set(j for i, j in pairs)) == games
+                and (their_required is None or their_required in [j for i, j in pairs])
+                and round(sum(scores[i][j] for i, j in pairs), 6) == round(total, 6)
+            )
+            if not valid:
+                raise AssertionError("top_lineups gave %s for %s" % (pairs, settings))
+
+        total, pairs, proven = branch_and_bound(scores, games, their_required, 60.0)
+        if not proven or round(total, 6) != round(expected[0][0], 6):
+            raise AssertionError("branch_and_bound %s for %s" % (total, settings))
+
+        if our_count <= 5 and their_count <= 5:
+            we_put_up = generator.random() < 0.5
+            value = solve_put_up(
+                scores,
+                games,
+                (1 << our_count) - 1,
+                (1 << their_count) - 1,
+                we_put_up,
+                {},
+            )
+            brute = brute_force_put_up(
+                scores, games, set(range(our_count)), set(range(their_count)), we_put_up
+            )
+            if round(value, 6) != round(brute, 6):
+                raise AssertionError(
+                    "solve_put_up %s, brute force %s for %s" % (value, brute, settings)
+                )
+
+
+if __name__ == "__main__":
+    trials = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    check(trials)
+    print ("%s random rosters checked" % trials)
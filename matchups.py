@@ -0,0 +1,448 @@
+"""Predict the points for a pairing of players
+
+Shared by player_maps.py, which predicts our team against one opponent,
+and division.py, which predicts every pairing in a division.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from races import get_race, get_races
+from simulations import SimulationCache, reseed, stream_seed
+import history
+
+GRAPHS = "one_line"
+SIMULATION_COUNT = 5000
+SIMULATION_METHOD = "exact"
+SPREADS = (0, -1, 1, -2, 2, -3, 3, -4, 4)  # order the skill-diff window widens in
+WINDOWS = [
+    (min(SPREADS[: step + 1]), max(SPREADS[: step + 1])) for step in range(len(SPREADS))
+]
+
+
+def get_combined_wins_losses(player, opponent, race_differential):
+    """Get combined wins and losses for a player as it relates to the opponent
+
+    The skill-diff window widens in SPREADS order until it holds
+    minimum_games.  Each window is two lookups in the players' running
+    totals, so the smallest window is found by binary search.
+
+    player(history.GameHistory): player's history for the game
+    opponent(history.GameHistory): opponent's history for the game
+    race_differential(int): skill difference
+
+    returns (combined_wins(int), combined_losses(int), spread(int))
+    """
+    minimum_games = 10 
+    player_sums, opponent_sums = player.sums, opponent.sums
+    player_offset = race_differential + player.offset
+    opponent_offset = race_differential + opponent.offset
+    player_last = 2 * player.offset + 1
+    opponent_last = 2 * opponent.offset + 1
+
+    def enough(step):
+        low, high = WINDOWS[step]
+        start = 2 * min(max(player_offset + low, 0), player_last)
+        end = 2 * min(max(player_offset + high + 1, 0), player_last)
+        games = player_sums[end] + player_sums[end + 1]
+        games -= player_sums[start] + player_sums[start + 1]
+        start = 2 * min(max(opponent_offset + low, 0), opponent_last)
+        end = 2 * min(max(opponent_offset + high + 1, 0), opponent_last)
+        games += opponent_sums[end] + opponent_sums[end + 1]
+        games -= opponent_sums[start] + opponent_sums[start + 1]
+        return games >= minimum_games
+
+    # gallop out from the narrowest window, then binary search the last gap
+    low, high = 0, 1
+    while high < len(SPREADS) and not enough(high - 1):
+        low, high = high, 2 * high
+    high = min(high, len(SPREADS)) - 1
+    while low < high:
+        step = (low + high) // 2
+        if enough(step):
+            high = step
+        else:
+            low = step + 1
+    low = race_differential + WINDOWS[high][0]
+    player_won, player_lost = player.window(low, race_differential + WINDOWS[high][1])
+    opponent_won, opponent_lost = opponent.window(
+        low, race_differential + WINDOWS[high][1]
+    )
+    return (player_won + opponent_lost, player_lost + opponent_won, SPREADS[high])
+
+
+def get_combined_wins_losses_matrix(players, opponents, race_differentials):
+    """get_combined_wins_losses for every pairing of players and opponents at once
+
+    args:
+      players(list): player's history.GameHistory per player
+      opponents(list): opponent's history.GameHistory per opponent
+      race_differentials(numpy.ndarray): skill difference per
+        [player, opponent]
+
+    returns (combined_wins, combined_losses, spreads):  numpy int arrays
+      indexed [player, opponent]
+    """
+    minimum_games = 10
+    offset, player_sums = history.stack_sums(players + opponents)
+    player_sums, opponent_sums = player_sums[: len(players)], player_sums[len(players) :]
+    rows = numpy.arange(len(players))[:, None]
+    columns = numpy.arange(len(opponents))[None, :]
+    race_differentials = numpy.asarray(race_differentials) + offset
+    wins = []
+    losses = []
+    for low, high in WINDOWS:
+        start = numpy.clip(race_differentials + low, 0, 2 * offset + 1)
+        end = numpy.clip(race_differentials + high + 1, 0, 2 * offset + 1)
+        player_games = player_sums[rows, end] - player_sums[rows, start]
+        opponent_games = opponent_sums[columns, end] - opponent_sums[columns, start]
+        wins.append(player_games[..., 0] + opponent_games[..., 1])
+        losses.append(player_games[..., 1] + opponent_games[..., 0])
+    wins = numpy.array(wins)
+    losses = numpy.array(losses)
+    enough = wins + losses >= minimum_games
+    steps = numpy.where(enough.any(axis=0), enough.argmax(axis=0), len(SPREADS) - 1)
+    return (
+        wins[steps, rows, columns],
+        losses[steps, rows, columns],
+        numpy.array(SPREADS)[steps],
+    )
+
+
+def predict_typical(predictions, player_history):
+    """Predict score by player's typical game play
+
+    args:
+      predictions(dict): prediction keyed by game ('8_ball', 9_ball, 10_ball)
+      player_history(history.PlayerHistory):  Player's history
+        Example in dict format:
+           u'Dan Hosier': {
+             'player_id': u'10068287',
+             '8_ball': {
+               0: {'games_lost': 14, 'games_won': 12},
+               1: {'games_lost': 2, 'games_won': 5},
+               2: {'games_lost': 9, 'games_won': 24},
+               3: {'games_lost': 0, 'games_won': 12},
+               4: {'games_lost': 6, 'games_won': 22},
+               -1: {'games_lost': 7, 'games_won': 5},
+               -3: {'games_lost': 7, 'games_won': 1},
+               -2: {'games_lost': 31, 'games_won': 23}
+              },
+              '9_ball': {
+                0: {'games_lost': 10, 'games_won': 7},
+                2: {'games_lost': 4, 'games_won': 5},
+                3: {'games_lost': 3, 'games_won': 2}
+              },
+              '10_ball': {
+                0: {'games_lost': 4, 'games_won': 2},
+                1: {'games_lost': 4, 'games_won': 2},
+                -1: {'games_lost': 14, 'games_won': 6},
+                -2: {'games_lost': 6, 'games_won': 3}
+              },
+              'skill_level': [84, 62, 59]
+           }
+    """
+    results = {}
+    total_games_played = 0
+    for game in ("8_ball", "9_ball", "10_ball"):
+        games_played = player_history[game].games_played()
+        results[game] = games_played * predictions[game]
+        total_games_played += games_played
+
+    return round(
+        (results["8_ball"] + results["9_ball"] + results["10_ball"])
+        / total_games_played,
+        2,
+    )
+
+
+def get_simulation_inputs(player, opponent, game_index, game):
+    """Get the race and combined win percentage for one game of a pairing
+
+    args:
+      player(history.PlayerHistory): our player's record
+      opponent(history.PlayerHistory): their player's record
+      game_index(int): index of the game in skill_level
+      game(str): values("8_ball", "9_ball", "10_ball")
+
+    returns (combined_win_percentage(float), my_race(int), their_race(int),
+             combined_total(int), spread_count(int))
+    """
+    my_race, their_race = get_race(
+        player["skill_level"][game_index], opponent["skill_level"][game_index],
+    )
+    race_differential = my_race - their_race
+    combined_wins, combined_losses, spread_count = get_combined_wins_losses(
+        player[game], opponent[game], race_differential,
+    )
+    combined_total = combined_wins + combined_losses
+    if combined_total == 0:
+        combined_win_percentage = 50
+    else:
+        combined_win_percentage = (float(combined_wins) / combined_total) * 100
+    return (
+        combined_win_percentage,
+        my_race,
+        their_race,
+        combined_total,
+        spread_count,
+    )
+
+
+def get_simulation_inputs_matrix(our_players, their_players, game_index, game):
+    """get_simulation_inputs for every pairing of two lists of player records
+
+    returns (combined_win_percentages, my_races, their_races,
+             combined_totals, spread_counts):  numpy arrays indexed
+             [our player, their player]
+    """
+    races = get_races(
+        [[player["skill_level"][game_index]] for player in our_players],
+        [[opponent["skill_level"][game_index] for opponent in their_players]],
+    ).reshape(len(our_players), len(their_players), 2)
+    my_races = races[..., 0]
+    their_races = races[..., 1]
+    combined_wins, combined_losses, spread_counts = get_combined_wins_losses_matrix(
+        [player[game] for player in our_players],
+        [opponent[game] for opponent in their_players],
+        my_races - their_races,
+    )
+    combined_totals = combined_wins + combined_losses
+    combined_win_percentages = numpy.where(
+        combined_totals == 0,
+        50.0,
+        combined_wins / numpy.maximum(combined_totals, 1).astype(float) * 100,
+    )
+    return (
+        combined_win_percentages,
+        my_races,
+        their_races,
+        combined_totals,
+        spread_counts,
+    )
+
+
+def with_skill_levels(players):
+    """Get the names of the players whose skill levels were collected"""
+    names = []
+    for name in players:
+        try:
+            if players[name]["skill_level"] is not None:
+                names.append(name)
+        except KeyError:
+            pass
+    return names
+
+
+def predict_matchup(
+    against,
+    player,
+    opponent,
+    simulation_cache,
+    simulation_count=SIMULATION_COUNT,
+    method=SIMULATION_METHOD,
+    graphs=GRAPHS,
+    batch_results=None,
+    seed=None,
+):
+    """Predict the points for each game of one pairing and render it
+
+    args:
+      against(str): opponent's name for the rendered lines
+      player(history.PlayerHistory): our player's record
+      opponent(history.PlayerHistory): their player's record
+      simulation_cache(simulations.SimulationCache): cache to simulate through
+      simulation_count(int): simulations per game
+      method(str): simulation method, see simulations.run_simulations
+      graphs(str): values("one_line", "bucket_per_line")
+      batch_results(dict): optional simulation results already run, by game
+      seed(int): optional pairing seed, stream_seed(master seed, player,
+        against), each game simulates with stream_seed(seed, game)
+
+    returns (prediction(dict), lines(list)):  points by game and "combined",
+      and the lines to print.  A pairing that can't be predicted stops
+      where it failed, like the loop it came from.
+    """
+    if batch_results is None:
+        batch_results = {}
+    game_map = {0: "8  ", 1: "9  ", 2: "10 "}
+    prediction = {}
+    lines = []
+    try:
+        prediction.setdefault("combined", {})
+        seed_games = {"8_ball": 0, "9_ball": 0, "10_ball": 0}
+        spread = {"8_ball": 0, "9_ball": 0, "10_ball": 0}
+        results = {}
+        for bucket in ["c_loss", "loss", "h_loss", "win", "c_win", "one_line"]:
+            results.setdefault(bucket, [])
+        game_index = 0
+        races = []
+        for game in ("8_ball", "9_ball", "10_ball"):
+            prediction.setdefault(game, 10)
+            (
+                combined_win_percentage,
+                my_race,
+                their_race,
+                combined_total,
+                spread_count,
+            ) = get_simulation_inputs(
+                player, opponent, game_index, game
+            )
+            seed_games[game] = seed_games[game] + combined_total
+            spread[game] = spread[game] + spread_count 
+            if game in batch_results:
+                simulation_results = batch_results[game]
+            else:
+                simulation_results = simulation_cache.run_simulations(
+                    combined_win_percentage,
+                    my_race,
+                    their_race,
+                    simulation_count,
+                    method,
+                    stream_seed(seed, game),
+                )
+            distribution = [
+                int(float(simulation_results[1]) / simulation_count * 100 + 0.5),
+                int(float(simulation_results[3]) / simulation_count * 100 + 0.5),
+                int(float(simulation_results[6]) / simulation_count * 100 + 0.5),
+                int(float(simulation_results[14]) / simulation_count * 100 + 0.5),
+                int(float(simulation_results[20]) / simulation_count * 100 + 0.5),
+            ]
+            prediction[game] = (
+                (distribution[1] * 3)
+                + (distribution[2] * 6)
+                + (distribution[3] * 14)
+                + (distribution[4] * 20)
+            ) / 100.0
+            while sum(distribution) < 100:
+                distribution[3] += 1
+            while sum(distribution) > 100:
+                distribution[3] -= 1
+            races.append("%s: %s-%s" % (game, my_race, their_race))
+            if "samples" in simulation_results:
+                races[-1] += " (%s races)" % simulation_results["samples"]
+            results["c_loss"].append(game_map[game_index] * distribution[0])
+            results["loss"].append(game_map[game_index] * distribution[1])
+            results["h_loss"].append(game_map[game_index] * distribution[2])
+            results["win"].append(game_map[game_index] * distribution[3])
+            results["c_win"].append(game_map[game_index] * distribution[4])
+            if seed_games[game] < 10:
+                results["one_line"].append(
+                    game_map[game_index] + "Not enough results".center(100)
+                )
+            else:
+                results["one_line"].append(
+                    game_map[game_index]
+                    + u"\u001b[45;1m"
+                    + str(distribution[0]).center(distribution[0])
+                    + u"\u001b[0m"
+                    + u"\u001b[41;1m"
+                    + str(distribution[1]).center(distribution[1])
+                    + u"\u001b[0m"
+                    + u"\u001b[43;1m"
+                    + str(distribution[2]).center(distribution[2])
+                    + u"\u001b[0m"
+                    + u"\u001b[42;1m"
+                    + str(distribution[3]).center(distribution[3])
+                    + u"\u001b[0m"
+                    + u"\u001b[44;1m"
+                    + str(distribution[4]).center(distribution[4])
+                    + u"\u001b[0m : "
+                    + str(prediction[game])
+                )
+
+            game_index += 1
+        lines.append(
+            "%s --- %s --- seed games %s, %s, %s --- skill %s %s %s --- spreads %s %s %s"
+            % (
+                against,
+                ", ".join(races),
+                seed_games["8_ball"],
+                seed_games["9_ball"],
+                seed_games["10_ball"],
+                str(opponent["skill_level"][0]),
+                str(opponent["skill_level"][1]),
+                str(opponent["skill_level"][2]),
+                spread["8_ball"],
+                spread["9_ball"],
+                spread["10_ball"],
+            )
+        )
+        if graphs == "bucket_per_line":
+            for bucket in ["c_loss", "loss", "h_loss", "win", "c_win"]:
+                for line in results[bucket]:
+                    lines.append("%s:\t%s" % (bucket, line))
+        elif graphs == "one_line":
+            lines.extend(results["one_line"])
+
+        our_pick = max(
+            prediction["8_ball"],
+            prediction["9_ball"],
+            prediction["10_ball"],
+        )
+        their_pick = predict_typical(prediction, opponent)
+        lines.append(
+            "Predictions:  Our Pick %s,   Their Pick %s,   Combined %s"
+            % (our_pick, their_pick, ((our_pick + their_pick) / 2))
+        )
+        prediction["combined"] = str(round((our_pick + their_pick) / 2, 2))
+        lines.append("-" * 103)
+    except:
+        pass
+    return prediction, lines
+
+
+pool_players = {}
+pool_cache = SimulationCache()
+pool_settings = (SIMULATION_COUNT, SIMULATION_METHOD, GRAPHS, None)
+
+
+def start_pool_worker(players, entries, simulation_count, method, graphs, seed=None):
+    """Give a pool process the players, cached simulations and settings
+
+    The global random generators are reseeded, see simulations.reseed.
+
+    args:
+      players(dict):  {team: {name: history.PlayerHistory}}
+      entries(dict):  simulation cache values to start from, see
+        simulations.SimulationCache.snapshot
+      simulation_count(int):  simulations per game
+      method(str):  simulation method, see simulations.run_simulations
+      graphs(str):  values("one_line", "bucket_per_line")
+      seed(int):  optional master seed, see simulations.stream_seed
+    """
+    global pool_players, pool_cache, pool_settings
+    reseed()
+    pool_players = players
+    pool_cache = SimulationCache(entries=entries)
+    pool_settings = (simulation_count, method, graphs, seed)
+
+
+def predict_pool_pairing(pairing):
+    """predict_matchup for one pairing in a pool process
+
+    args:
+      pairing(tuple):  (team, player, against_team, against, batch_results)
+
+    returns (prediction(dict), lines(list), entries(dict), stats(dict)):
+      predict_matchup's prediction and lines, and the simulation cache
+      values and stats gathered for this pairing, to merge into the main
+      process's cache
+    """
+    team, player, against_team, against, batch_results = pairing
+    simulation_count, method, graphs, seed = pool_settings
+    prediction, lines = predict_matchup(
+        against,
+        pool_players[team][player],
+        pool_players[against_team][against],
+        pool_cache,
+        simulation_count,
+        method,
+        graphs,
+        batch_results,
+        stream_seed(seed, player, against),
+    )
+    entries, stats = pool_cache.changes()
+    return prediction, lines, entries, stats
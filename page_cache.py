@@ -0,0 +1,172 @@
+"""Keep fetched NAPA pages on disk between runs
+
+Pages are stored one file per URL, named like fixture_server fixtures, so a
+cache directory can also be served with fixture_server.  Each page type
+has its own time to live, the directory is kept under a size limit by
+removing the least recently used pages, and an offline mode serves pages
+only from the cache.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import fixture_server
+
+DAY = 24 * 60 * 60
+TTLS = {
+    "rosters": 7 * DAY,
+    "skill_levels": 7 * DAY,
+    # stats pages are offsets from the newest match, so they all shift when
+    # a new week is played
+    "stats": DAY,
+}
+MAX_BYTES = 200 * 1024 * 1024
+
+
+def page_type(url):
+    """Get the page type of a NAPA URL: rosters, skill_levels or stats"""
+    if "xTab=" in url:
+        return "stats"
+    if "playerID=" in url:
+        return "skill_levels"
+    return "rosters"
+
+
+class PageCache(object):
+    """Page source by URL in a directory with per page type expiry
+
+    args:
+      directory(str):  directory to keep pages in
+      ttls(dict):  seconds a page stays fresh by page_type, None never expires
+      max_bytes(int):  least recently used pages are removed above this size
+    """
+
+    def __init__(self, directory, ttls=TTLS, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.ttls = ttls
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # file name: bytes, least recently used first
+        self.size = 0
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        pages = []
+        for name in os.listdir(directory):
+            if name.endswith(".html"):
+                status = os.stat(os.path.join(directory, name))
+                pages.append((status.st_mtime, name, status.st_size))
+        for modified, name, size in sorted(pages):
+            self.entries[name] = size
+            self.size += size
+
+    def get(self, url, offline=False):
+        """Get the cached source of a page
+
+        args:
+          url(str):  page URL
+          offline(bool):  serve expired pages too
+
+        returns:
+          source(str):  page source, None when the page is missing or expired
+        """
+        name = fixture_server.fixture_name(url)
+        path = os.path.join(self.directory, name)
+        with self.lock:
+            if name not in self.entries:
+                self.stats["misses"] += 1
+                return None
+            ttl = self.ttls.get(page_type(url))
+            if not offline and ttl is not None:
+                if time.time() - os.path.getmtime(path) > ttl:
+                    self.stats["expired"] += 1
+                    return None
+            self.entries[name] = self.entries.pop(name)
+            self.stats["hits"] += 1
+            with open(path, "rb") as page:
+                return page.read().decode("utf-8")
+
+    def put(self, url, source):
+        """Store the source of a page, removing old pages to stay under max_bytes"""
+        name = fixture_server.fixture_name(url)
+        path = os.path.join(self.directory, name)
+        data = source.encode("utf-8")
+        with self.lock:
+            temporary_path = "%s.tmp" % path
+            with open(temporary_path, "wb") as page:
+                page.write(data)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(temporary_path, path)
+            self.size -= self.entries.pop(name, 0)
+            self.entries[name] = len(data)
+            self.size += len(data)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                oldest, size = self.entries.popitem(last=False)
+                os.remove(os.path.join(self.directory, oldest))
+                self.size -= size
+                self.stats["evictions"] += 1
+
+    def report(self):
+        """Describe cache hits, misses and size"""
+        with self.lock:
+            return (
+                "page cache: %s hits, %s misses, %s expired, %s evictions, "
+                "%s pages, %.1f MB"
+                % (
+                    self.stats["hits"],
+                    self.stats["misses"],
+                    self.stats["expired"],
+                    self.stats["evictions"],
+                    len(self.entries),
+                    self.size / 1048576.0,
+                )
+            )
+
+
+class CachedBrowser(object):
+    """Wrap a browser so get() is answered from a PageCache when it can
+
+    Only works with parser="page_source".  Pages the browser fetches are
+    added to the cache.
+
+    args:
+      browser:  browser to fetch missing pages with, may be None when offline
+      cache(PageCache):  shared page cache
+      offline(bool):  only serve pages from the cache, a missing page raises
+        KeyError
+    """
+
+    def __init__(self, browser, cache, offline=False):
+        self.browser = browser
+        self.cache = cache
+        self.offline = offline
+        self.current_url = None
+        self.page_source = ""
+
+    def get(self, url):
+        source = self.cache.get(url, self.offline)
+        if source is None:
+            if self.offline:
+                raise KeyError("%s is not in the page cache" % url)
+            self.browser.get(url)
+            source = self.browser.page_source
+            self.cache.put(url, source)
+        self.current_url = url
+        self.page_source = source
+
+    def implicitly_wait(self, seconds):
+        pass  # cached pages are complete, browser.get() does its own waiting
+
+    def close(self):
+        if self.browser is not None:
+            self.browser.close()
+
+    def __getattr__(self, name):
+        if name.startswith("find_element"):
+            # a cached page was never loaded in the browser, it would read
+            # whatever page it loaded last
+            raise AttributeError("%s needs parser=\"page_source\" with a cache" % name)
+        return getattr(self.browser, name)
@@ -0,0 +1,137 @@
+"""Races between two players by skill level
+
+RACE_TABLES is keyed by the skill class of the stronger player (stronger
+skill must be above the key), then by the difference in skill levels
+(difference must be above the key).  Values are (stronger race, weaker race).
+
+RACE_LOOKUP holds the answer for every pair of skill levels from 0 to
+MAX_SKILL so get_race is a single index.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAX_SKILL = 100
+
+RACE_TABLES = {
+    89: {
+        74: (10, 2),
+        68: (9, 2),
+        58: (8, 2),
+        48: (9, 3),
+        42: (8, 3),
+        35: (7, 3),
+        28: (8, 4),
+        22: (7, 4),
+        17: (6, 4),
+        11: (7, 5),
+        4: (6, 5),
+        -1: (6, 6),
+    },
+    69: {
+        62: (8, 2),
+        56: (7, 2),
+        46: (6, 2),
+        36: (7, 3),
+        28: (6, 3),
+        21: (5, 3),
+        14: (6, 4),
+        5: (5, 4),
+        -1: (5, 5),
+    },
+    49: {
+        48: (6, 2),
+        39: (5, 2),
+        29: (4, 2),
+        18: (5, 3),
+        6: (4, 3),
+        -1: (4, 4),
+    },
+    39: {
+        26: (4, 2),
+        10: (3, 2),
+        -1: (3, 3),
+    },
+    -1: {
+        19: (3, 2),
+        -1: (2, 2),
+    },
+}
+
+
+def lookup_race(player1skill, player2skill):
+    """Get the race between 2 players by scanning RACE_TABLES
+
+    args:
+      player1skill(int): skill rating of our player
+      player2skill(int): skill rating of the opponent player
+
+    returns:
+      (unnamed tuple):  (ourrace, theirrace), None below every skill class
+    """
+    stronger = max(player1skill, player2skill)
+    weaker = min(player1skill, player2skill)
+    difference = stronger - weaker
+    for skillclass in reversed(sorted(RACE_TABLES)):
+        if stronger > skillclass:
+            for skill_level_difference in reversed(sorted(RACE_TABLES[skillclass])):
+                if difference > skill_level_difference:
+                    if stronger == player1skill:
+                        return RACE_TABLES[skillclass][skill_level_difference]
+                    else:
+                        return tuple(
+                            reversed(RACE_TABLES[skillclass][skill_level_difference])
+                        )
+
+
+RACE_LOOKUP = [
+    [lookup_race(player1skill, player2skill) for player2skill in range(0, MAX_SKILL + 1)]
+    for player1skill in range(0, MAX_SKILL + 1)
+]
+
+if numpy is not None:
+    RACE_ARRAY = numpy.array(RACE_LOOKUP, dtype=int)
+else:
+    RACE_ARRAY = None
+
+
+def get_race(player1skill, player2skill):
+    """Get the race between 2 players
+
+    args:
+      player1skill(int): skill rating of our player
+      player2skill(int): skill rating of the opponent player
+
+    returns:
+      (unnamed list):  (ourrace, theirrace)
+    """
+    try:
+        if 0 <= player1skill <= MAX_SKILL and 0 <= player2skill <= MAX_SKILL:
+            return list(RACE_LOOKUP[player1skill][player2skill])
+    except TypeError:  # not an integer skill level
+        pass
+    race = lookup_race(player1skill, player2skill)
+    if race is not None:
+        return list(race)
+
+
+def get_races(player1skills, player2skills):
+    """Get the races for whole arrays of skill level pairs
+
+    args:
+      player1skills(sequence):  skill ratings of our players (0 to MAX_SKILL)
+      player2skills(sequence):  skill ratings of the opponent players (0 to MAX_SKILL)
+
+    returns:
+      races(numpy.ndarray):  (..., 2) array of (ourrace, theirrace)
+    """
+    if RACE_ARRAY is None:
+        raise ImportError("numpy is required for get_races")
+    player1skills = numpy.asarray(player1skills, dtype=int)
+    player2skills = numpy.asarray(player2skills, dtype=int)
+    for skills in (player1skills, player2skills):
+        if skills.size and (skills.min() < 0 or skills.max() > MAX_SKILL):
+            raise ValueError("skill levels must be between 0 and %s" % MAX_SKILL)
+    return RACE_ARRAY[player1skills, player2skills]
@@ -0,0 +1,176 @@
+"""Schedule scrape requests across worker threads
+
+Every page load goes through one RequestScheduler.  A token bucket sets
+the pace: the rate creeps up while the site answers quickly and drops by a
+quarter on errors or slow responses.  Failed requests are retried a bounded
+number of times with exponential backoff and jitter.  Only transient
+errors are retried, anything else (a 404, a parse error) is raised at once.
+"""
+
+import random
+import threading
+import time
+
+# error classes, or their bases, that are worth retrying: selenium, asyncio
+# and aiohttp timeouts and dropped connections
+TRANSIENT_ERRORS = (
+    "TimeoutException",
+    "TimeoutError",
+    "ClientConnectionError",
+    "ClientPayloadError",
+)
+
+
+def transient(error):
+    """Check whether a failed request is worth retrying
+
+    Connection errors, timeouts, 429 and 5xx responses are.  A status is
+    read from requests' HTTPError (error.response.status_code) or aiohttp's
+    ClientResponseError (error.status).
+    """
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is None:
+        status = getattr(error, "status", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    if isinstance(error, EnvironmentError):  # sockets, requests' ConnectionError
+        return True
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(error).__mro__)
+
+
+class RequestScheduler(object):
+    """Token bucket rate limiter with adaptive rate, retries and statistics
+
+    args:
+      requests_per_second(float):  starting request rate
+      max_requests_per_second(float):  the rate never goes above this
+      min_requests_per_second(float):  the rate never goes below this
+      retries(int):  attempts after the first before giving up
+      backoff(float):  seconds before the first retry, doubled every retry
+      slow_seconds(float):  responses slower than this slow the rate down
+      burst(int):  requests that may go out back to back
+    """
+
+    SPEEDUP = 1.05
+    SLOWDOWN = 0.75
+
+    def __init__(
+        self,
+        requests_per_second=4.0,
+        max_requests_per_second=10.0,
+        min_requests_per_second=0.5,
+        retries=3,
+        backoff=1.0,
+        slow_seconds=5.0,
+        burst=1,
+    ):
+        self.rate = float(requests_per_second)
+        self.max_rate = float(max_requests_per_second)
+        self.min_rate = float(min_requests_per_second)
+        self.retries = retries
+        self.backoff = backoff
+        self.slow_seconds = slow_seconds
+        self.burst = burst
+        self.tokens = float(burst)
+        self.refilled = time.time()
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "slow": 0}
+
+    def acquire(self):
+        """Block until a token is available and take it"""
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.refilled) * self.rate
+                )
+                self.refilled = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def record(self, seconds, ok):
+        """Record a response and adapt the rate to it"""
+        with self.lock:
+            self.stats["requests"] += 1
+            self.latencies.append(seconds)
+            if ok and seconds <= self.slow_seconds:
+                self.rate = min(self.max_rate, self.rate * self.SPEEDUP)
+            else:
+                if ok:
+                    self.stats["slow"] += 1
+                self.rate = max(self.min_rate, self.rate * self.SLOWDOWN)
+
+    def request(self, function, *args):
+        """Call function(*args) under the rate limit, retrying on errors
+
+        returns whatever function returns, the last error is raised once
+        every retry has failed and errors that aren't transient are raised
+        straight away
+        """
+        for attempt in range(self.retries + 1):
+            self.acquire()
+            start = time.time()
+            try:
+                result = function(*args)
+            except Exception as error:
+                if not transient(error):
+                    with self.lock:
+                        self.stats["requests"] += 1
+                        self.stats["failures"] += 1
+                    raise
+                self.record(time.time() - start, False)
+                if attempt == self.retries:
+                    with self.lock:
+                        self.stats["failures"] += 1
+                    raise
+                with self.lock:
+                    self.stats["retries"] += 1
+                time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+                continue
+            self.record(time.time() - start, True)
+            return result
+
+    def report(self):
+        """Describe request counts, retries and latency"""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = dict(self.stats)
+            rate = self.rate
+        if latencies:
+            mean = sum(latencies) / len(latencies)
+            median = latencies[len(latencies) // 2]
+            slowest = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        else:
+            mean = median = slowest = 0.0
+        return (
+            "requests: %s attempts, %s retries, %s failures, %s slow, "
+            "latency mean %.2fs p50 %.2fs p95 %.2fs, rate %.1f/s"
+            % (
+                stats["requests"],
+                stats["retries"],
+                stats["failures"],
+                stats["slow"],
+                mean,
+                median,
+                slowest,
+                rate,
+            )
+        )
+
+
+class ThrottledBrowser(object):
+    """Wrap a browser so every get() goes through a shared RequestScheduler"""
+
+    def __init__(self, browser, scheduler):
+        self.browser = browser
+        self.scheduler = scheduler
+
+    def get(self, url):
+        self.scheduler.request(self.browser.get, url)
+
+    def __getattr__(self, name):
+        return getattr(self.browser, name)
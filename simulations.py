@@ -0,0 +1,628 @@
+"""Race outcome engines shared by collect_data.py and player_maps.py
+
+A race is a sequence of independent games that ends when our player reaches
+my_race wins or their player reaches their_race wins.  Every engine buckets
+the outcome by the points earned by our player:
+
+    1:  no wins
+    3:  1 or more wins
+    6:  hill loss (one game short of my_race)
+    14: match win
+    20: shutout
+
+The sampled engines draw from the global random generators unless given a
+seed.  stream_seed derives a seed per task from one master seed, like
+numpy's SeedSequence.spawn, so seeded results are the same however many
+processes run the tasks and in whatever order.  SimulationCache keeps
+unseeded results on disk, so an unseeded run reuses earlier runs' races.
+"""
+
+import binascii
+import hashlib
+import math
+import os
+import pickle
+import random
+import time
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+BUCKETS = (1, 3, 6, 14, 20)
+BATCH_CHUNK_SIZE = 2000000
+SEQUENTIAL_CHUNK = 1000  # races played between checks of the stopping rule
+TOLERANCE = 0.01  # largest confidence interval half width of a bucket's share
+POINTS_TOLERANCE = 0.1  # largest half width of the expected points
+CONFIDENCE = 0.95
+
+
+def empty_results():
+    """Get a results dictionary with every bucket at zero"""
+    return {bucket: 0 for bucket in BUCKETS}
+
+
+def stream_seed(seed, *key):
+    """Derive the seed of an independent random stream from a parent seed
+
+    args:
+      seed(int):  master seed, or a seed already derived from it
+      key:  what the stream is for, like (player, against) then game
+
+    returns:
+      (int):  128 bit seed, None when seed is None
+    """
+    if seed is None:
+        return None
+    text = u"\x00".join([u"%s" % part for part in (seed,) + key])
+    return int(binascii.hexlify(hashlib.sha256(text.encode("utf-8")).digest()[:16]), 16)
+
+
+def reseed():
+    """Reseed the global random generators from the operating system
+
+    A forked pool process starts with a copy of its parent's generator
+    state, every process would draw the same unseeded races without this.
+    """
+    random.seed()
+    if numpy is not None:
+        numpy.random.seed()
+
+
+def numpy_stream(seed):
+    """Get a numpy RandomState seeded with a stream_seed seed"""
+    words = [(seed >> (32 * word)) & 0xFFFFFFFF for word in range(4)]
+    return numpy.random.RandomState(numpy.array(words, dtype=numpy.uint32))
+
+
+def game_win_probability(combined_win_percentage):
+    """Get the probability of our player winning a single game
+
+    The Monte Carlo engine wins a game when
+    combined_win_percentage > random.randrange(100), so the percentage is
+    rounded up to the next whole number before it becomes a probability.
+
+    args:
+      combined_win_percentage(float):  Percentage chance to win a game (0-100)
+
+    returns:
+      (float):  probability between 0.0 and 1.0
+    """
+    whole_percent = int(combined_win_percentage)
+    if whole_percent < combined_win_percentage:
+        whole_percent += 1
+    return min(100, max(0, whole_percent)) / 100.0
+
+
+def choose(n, k):
+    """Binomial coefficient n choose k"""
+    if k < 0 or k > n:
+        return 0
+    k = min(k, n - k)
+    result = 1
+    for i in range(1, k + 1):
+        result = result * (n - k + i) // i
+    return result
+
+
+def exact_probabilities(combined_win_percentage, my_race, their_race):
+    """Get the exact probability of each points bucket
+
+    Winning a race with k games lost is negative binomial,
+    choose(my_race - 1 + k, k) * p**my_race * q**k, and losing a race with
+    w games won is choose(their_race - 1 + w, w) * q**their_race * p**w.
+
+    args:
+      combined_win_percentage(float):  Percentage chance to win a game (0-100)
+      my_race(int):  games needed for our player to win
+      their_race(int):  games needed for their player to win
+
+    returns:
+      results(dict):  Dictionary of probabilities keyed by points bucket
+    """
+    p = game_win_probability(combined_win_percentage)
+    q = 1.0 - p
+    results = dict.fromkeys(BUCKETS, 0.0)
+    for games_lost in range(0, their_race):  # I won
+        chance = choose(my_race - 1 + games_lost, games_lost) * p ** my_race * q ** games_lost
+        if games_lost == 0:
+            results[20] += chance
+        else:
+            results[14] += chance
+    for games_won in range(0, my_race):  # I lost
+        chance = choose(their_race - 1 + games_won, games_won) * q ** their_race * p ** games_won
+        if games_won == my_race - 1:
+            results[6] += chance
+        elif games_won > 0:
+            results[3] += chance
+        else:
+            results[1] += chance
+    return results
+
+
+def monte_carlo_simulations(
+    combined_win_percentage, my_race, their_race, SIMULATION_COUNT, seed=None
+):
+    """Play out SIMULATION_COUNT races game by game and count each bucket
+
+    seed(int) draws from a random.Random of its own instead of the random
+    module
+    """
+    generator = random if seed is None else random.Random(seed)
+    results = empty_results()
+    for x in range(0, SIMULATION_COUNT):
+        games_won = 0
+        games_lost = 0
+        while True:
+            if combined_win_percentage > generator.randrange(100):
+                games_won += 1
+            else:
+                games_lost += 1
+            if any((games_won == my_race, games_lost == their_race)):
+                break
+        if games_lost == their_race:  # I lost
+            if games_won == my_race - 1:
+                results[6] += 1
+            elif games_won > 0:
+                results[3] += 1
+            else:
+                results[1] += 1
+        else:  # I won
+            if games_lost == 0:
+                results[20] += 1
+            else:
+                results[14] += 1
+    return results
+
+
+def simulate_batch(win_percentages, my_races, their_races, SIMULATION_COUNT, seeds=None):
+    """Play out SIMULATION_COUNT races for every matchup at once with numpy
+
+    All matchups advance one game per step, so the python loop runs at most
+    max(my_races + their_races - 1) times per chunk of simulations.  Chunks
+    keep matchups * simulations under BATCH_CHUNK_SIZE.
+
+    Seeded matchups draw every game a race could need, my_race +
+    their_race - 1 per simulation, from their own stream, so a matchup's
+    counts don't depend on the other matchups in the batch or the chunk size.
+
+    args:
+      win_percentages(sequence):  combined_win_percentage per matchup
+      my_races(sequence):  games needed for our player to win per matchup
+      their_races(sequence):  games needed for their player to win per matchup
+      SIMULATION_COUNT(int):  Number of iterations per matchup
+      seeds(sequence):  optional stream_seed seed per matchup, None draws
+        from numpy.random
+
+    returns:
+      counts(numpy.ndarray):  (matchups, 5) array of counts, columns in BUCKETS order
+    """
+    if numpy is None:
+        raise ImportError("numpy is required for batch simulations")
+    win_percentages = numpy.asarray(win_percentages, dtype=float).reshape(-1, 1)
+    my_races = numpy.asarray(my_races, dtype=int).reshape(-1, 1)
+    their_races = numpy.asarray(their_races, dtype=int).reshape(-1, 1)
+    matchups = win_percentages.shape[0]
+    counts = numpy.zeros((matchups, len(BUCKETS)), dtype=numpy.int64)
+    if matchups == 0:
+        return counts
+    max_games = int((my_races + their_races).max()) - 1
+    chunk = max(1, min(SIMULATION_COUNT, BATCH_CHUNK_SIZE // matchups))
+    streams = None
+    if seeds is not None:
+        streams = [numpy_stream(seed) for seed in seeds]
+    remaining = SIMULATION_COUNT
+    while remaining > 0:
+        size = min(chunk, remaining)
+        remaining -= size
+        games_won = numpy.zeros((matchups, size), dtype=numpy.int16)
+        games_lost = numpy.zeros((matchups, size), dtype=numpy.int16)
+        if streams is not None:
+            draws = numpy.zeros((matchups, size, max_games), dtype=numpy.int8)
+            for row, stream in enumerate(streams):
+                games = int(my_races[row, 0] + their_races[row, 0]) - 1
+                # the default dtype, smaller ones don't carry the stream
+                # over from one call to the next the same way
+                draws[row, :, :games] = stream.randint(0, 100, (size, games))
+        for x in range(0, max_games):
+            playing = (games_won < my_races) & (games_lost < their_races)
+            if streams is None:
+                draw = numpy.random.randint(0, 100, (matchups, size))
+            else:
+                draw = draws[:, :, x]
+            won = win_percentages > draw
+            games_won += playing & won
+            games_lost += playing & ~won
+        lost_race = games_lost == their_races
+        hill = lost_race & (games_won == my_races - 1)
+        counts[:, 0] += (lost_race & ~hill & (games_won == 0)).sum(axis=1)
+        counts[:, 1] += (lost_race & ~hill & (games_won > 0)).sum(axis=1)
+        counts[:, 2] += hill.sum(axis=1)
+        counts[:, 3] += (~lost_race & (games_lost > 0)).sum(axis=1)
+        counts[:, 4] += (~lost_race & (games_lost == 0)).sum(axis=1)
+    return counts
+
+
+def z_score(confidence):
+    """Get the two sided normal quantile for a confidence level like 0.95"""
+    low, high = 0.0, 10.0
+    for x in range(60):
+        middle = (low + high) / 2
+        if math.erf(middle / math.sqrt(2)) < confidence:
+            low = middle
+        else:
+            high = middle
+    return high
+
+
+def sequential_simulations(
+    combined_win_percentage,
+    my_race,
+    their_race,
+    SIMULATION_COUNT,
+    seed=None,
+    tolerance=TOLERANCE,
+    points_tolerance=POINTS_TOLERANCE,
+    confidence=CONFIDENCE,
+):
+    """Play races in chunks of SEQUENTIAL_CHUNK until the estimates are tight
+
+    Stops once every bucket's share and the expected points are inside
+    their tolerance at the given confidence, or after SIMULATION_COUNT
+    races.  A lopsided race settles after a chunk or two, a close one plays
+    on.  Seeded chunks draw from stream_seed(seed, chunk).
+
+    returns (counts(dict), samples(int)):  races per bucket and the races
+      played
+    """
+    z = z_score(confidence)
+    counts = empty_results()
+    samples = 0
+    chunk = 0
+    while samples < SIMULATION_COUNT:
+        size = min(SEQUENTIAL_CHUNK, SIMULATION_COUNT - samples)
+        chunk_counts = simulate_batch(
+            [combined_win_percentage],
+            [my_race],
+            [their_race],
+            size,
+            None if seed is None else [stream_seed(seed, chunk)],
+        )
+        for bucket, count in zip(BUCKETS, chunk_counts[0]):
+            counts[bucket] += int(count)
+        samples += size
+        chunk += 1
+        shares = dict((bucket, float(counts[bucket]) / samples) for bucket in BUCKETS)
+        points = sum(bucket * shares[bucket] for bucket in BUCKETS)
+        variance = sum(bucket ** 2 * shares[bucket] for bucket in BUCKETS) - points ** 2
+        if z * math.sqrt(max(0.0, variance) / samples) > points_tolerance:
+            continue
+        if all(
+            z * math.sqrt(shares[bucket] * (1 - shares[bucket]) / samples) <= tolerance
+            for bucket in BUCKETS
+        ):
+            break
+    return counts, samples
+
+
+def run_simulations(
+    combined_win_percentage,
+    my_race,
+    their_race,
+    SIMULATION_COUNT,
+    method="exact",
+    seed=None,
+):
+    """Run simulations based on combined_win_percentage, games needed for a win
+    and bucket the results across the points received per simulation
+
+    args:
+      combined_win_percentage(float):  Average of (
+        our player's percentage games won  at this race,
+        their player's percentage games lost at this race
+      )
+      my_race(int):  games needed for our player to win
+      their_race(int):  games needed for their player to win
+      SIMULATION_COUNT(int):  Number of iterations to get the counts.
+      method(str):  values("exact", "monte_carlo", "batch")
+        exact scales the exact bucket probabilities to SIMULATION_COUNT,
+        monte_carlo plays every race out and is kept as a cross-check,
+        batch plays every race out with simulate_batch,
+        sequential plays races until sequential_simulations' stopping rule
+        is met, at most SIMULATION_COUNT
+      seed(int):  optional stream_seed seed for the sampled methods, None
+        draws from the global random generators
+
+    returns:
+      results(dict):  Dictionary of simulation result counts bucketed by points earned by our player
+        ex.
+          results{
+            1:  5000,
+            3:  30000,
+            6:  30000,
+            14: 30000,
+            20: 5000,
+          }
+        sequential counts are scaled to SIMULATION_COUNT and "samples"
+        holds the races actually played
+    """
+    if method == "exact":
+        probabilities = exact_probabilities(combined_win_percentage, my_race, their_race)
+        return {
+            bucket: probabilities[bucket] * SIMULATION_COUNT for bucket in BUCKETS
+        }
+    if method == "monte_carlo":
+        return monte_carlo_simulations(
+            combined_win_percentage, my_race, their_race, SIMULATION_COUNT, seed
+        )
+    if method == "batch":
+        counts = simulate_batch(
+            [combined_win_percentage],
+            [my_race],
+            [their_race],
+            SIMULATION_COUNT,
+            None if seed is None else [seed],
+        )
+        return {bucket: int(count) for bucket, count in zip(BUCKETS, counts[0])}
+    if method == "sequential":
+        counts, samples = sequential_simulations(
+            combined_win_percentage, my_race, their_race, SIMULATION_COUNT, seed
+        )
+        results = dict(
+            (bucket, counts[bucket] * float(SIMULATION_COUNT) / samples)
+            for bucket in BUCKETS
+        )
+        results["samples"] = samples
+        return results
+    raise ValueError("Unknown simulation method %s" % method)
+
+
+class SimulationCache(object):
+    """Memoize run_simulations by (win percentage, my_race, their_race)
+
+    Results live in an in-memory LRU of max_entries.  Given a path they are
+    also kept in a pickle file, so collect_data.py and player_maps.py runs
+    share them.  Exact results are stored as probabilities and scaled to the
+    requested SIMULATION_COUNT, sampled results are keyed by the count too.
+    Seeded sampled results only live in the LRU, a seed names one run's
+    streams and is never written to path.
+    Hit and miss counts are kept for this run and for every run saved to
+    the same path.
+
+    args:
+      path(str):  optional pickle file for the on-disk store
+      max_entries(int):  size of the in-memory LRU
+      entries(dict):  optional values to start the store from, like another
+        cache's snapshot()
+    """
+
+    STATS = ("hits", "disk_hits", "misses", "compute_seconds")
+
+    def __init__(self, path=None, max_entries=4096, entries=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.stored = {} if entries is None else entries
+        self.stats = dict.fromkeys(self.STATS, 0)
+        self.stored_stats = dict.fromkeys(self.STATS, 0)
+        self.added = {}
+        self.reported = dict.fromkeys(self.STATS, 0)
+        if path is not None and os.path.exists(path):
+            with open(path, "rb") as cache_file:
+                stored = pickle.load(cache_file)
+            self.stored = dict(
+                (key, value)
+                for key, value in stored["entries"].items()
+                if not self.seeded(key)
+            )
+            self.stored_stats.update(stored["stats"])
+
+    def key(
+        self,
+        combined_win_percentage,
+        my_race,
+        their_race,
+        SIMULATION_COUNT,
+        method,
+        seed=None,
+    ):
+        """Get the cache key, every engine only sees the whole win percentage
+
+        Seeded sampled results are keyed by their seed too, so a task never
+        gets the results of another task's stream.
+        """
+        percent = int(round(game_win_probability(combined_win_percentage) * 100))
+        if method == "exact":
+            return (percent, my_race, their_race, method)
+        if method == "sequential":
+            method = (method, SEQUENTIAL_CHUNK, TOLERANCE, POINTS_TOLERANCE, CONFIDENCE)
+        if seed is not None:
+            return (percent, my_race, their_race, method, SIMULATION_COUNT, seed)
+        return (percent, my_race, their_race, method, SIMULATION_COUNT)
+
+    @staticmethod
+    def seeded(key):
+        """Whether a key holds seeded results, which are never persisted"""
+        return len(key) == 6
+
+    def remember(self, key, value):
+        """Add to the LRU, evicted unseeded entries fall back to the on-disk store"""
+        self.entries[key] = value
+        while len(self.entries) > self.max_entries:
+            evicted, evicted_value = self.entries.popitem(last=False)
+            if self.path is not None and not self.seeded(evicted):
+                self.stored[evicted] = evicted_value
+
+    def get(
+        self,
+        combined_win_percentage,
+        my_race,
+        their_race,
+        SIMULATION_COUNT,
+        method="exact",
+        seed=None,
+    ):
+        """Get cached run_simulations results, None on a miss"""
+        key = self.key(
+            combined_win_percentage, my_race, their_race, SIMULATION_COUNT, method, seed
+        )
+        if key in self.entries:
+            self.stats["hits"] += 1
+            value = self.entries.pop(key)
+            self.entries[key] = value
+        elif key in self.stored:
+            self.stats["disk_hits"] += 1
+            value = self.stored[key]
+            self.remember(key, value)
+        else:
+            self.stats["misses"] += 1
+            return None
+        return self.scale(value, SIMULATION_COUNT, method)
+
+    def scale(self, value, SIMULATION_COUNT, method):
+        """Get run_simulations results from a cached value"""
+        if method == "exact":
+            return {bucket: value[bucket] * SIMULATION_COUNT for bucket in BUCKETS}
+        return dict(value)
+
+    def put(
+        self,
+        combined_win_percentage,
+        my_race,
+        their_race,
+        SIMULATION_COUNT,
+        method,
+        results,
+        compute_seconds=0.0,
+        seed=None,
+    ):
+        """Store run_simulations results and the time it took to get them"""
+        key = self.key(
+            combined_win_percentage, my_race, their_race, SIMULATION_COUNT, method, seed
+        )
+        if method == "exact":
+            value = {
+                bucket: float(results[bucket]) / SIMULATION_COUNT for bucket in BUCKETS
+            }
+        else:
+            value = dict(results)
+        self.remember(key, value)
+        self.added[key] = value
+        self.stats["compute_seconds"] += compute_seconds
+
+    def run_simulations(
+        self,
+        combined_win_percentage,
+        my_race,
+        their_race,
+        SIMULATION_COUNT,
+        method="exact",
+        seed=None,
+    ):
+        """run_simulations through the cache"""
+        results = self.get(
+            combined_win_percentage, my_race, their_race, SIMULATION_COUNT, method, seed
+        )
+        if results is None:
+            start = time.time()
+            results = run_simulations(
+                combined_win_percentage,
+                my_race,
+                their_race,
+                SIMULATION_COUNT,
+                method,
+                seed,
+            )
+            self.put(
+                combined_win_percentage,
+                my_race,
+                their_race,
+                SIMULATION_COUNT,
+                method,
+                results,
+                time.time() - start,
+                seed,
+            )
+            # return what a hit would, so results never depend on what is
+            # already cached or which process cached it
+            key = self.key(
+                combined_win_percentage,
+                my_race,
+                their_race,
+                SIMULATION_COUNT,
+                method,
+                seed,
+            )
+            results = self.scale(self.entries[key], SIMULATION_COUNT, method)
+        return results
+
+    def snapshot(self):
+        """Get every cached value, to start another process's cache from"""
+        entries = dict(self.stored)
+        entries.update(self.entries)
+        return entries
+
+    def changes(self):
+        """Get the values put and the stats gathered since the last call
+
+        A pool process's cache hands these back after every task, to merge
+        into the main process's cache.
+        """
+        entries, self.added = self.added, {}
+        stats = dict(
+            (stat, self.stats[stat] - self.reported[stat]) for stat in self.STATS
+        )
+        self.reported = dict(self.stats)
+        return entries, stats
+
+    def merge(self, entries, stats):
+        """Add the values and stats another cache gathered, like a worker's"""
+        for key, value in entries.items():
+            self.remember(key, value)
+        for stat in self.STATS:
+            self.stats[stat] += stats[stat]
+
+    def season_stats(self):
+        """Get stats for this run added to every run saved to path"""
+        return {stat: self.stored_stats[stat] + self.stats[stat] for stat in self.STATS}
+
+    def report(self):
+        """Describe hits, misses and the estimated compute time saved
+
+        The time saved is every hit priced at the average time of a miss.
+        """
+        lines = []
+        for label, stats in (("run", self.stats), ("season", self.season_stats())):
+            lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+            cached = stats["hits"] + stats["disk_hits"]
+            seconds_per_miss = stats["compute_seconds"] / max(1, stats["misses"])
+            lines.append(
+                "simulation cache (%s): %s lookups, %s memory hits, %s disk hits, "
+                "%s misses, %.1f%% hit rate, ~%.2fs saved"
+                % (
+                    label,
+                    lookups,
+                    stats["hits"],
+                    stats["disk_hits"],
+                    stats["misses"],
+                    100.0 * cached / max(1, lookups),
+                    cached * seconds_per_miss,
+                )
+            )
+        return "\n".join(lines)
+
+    def save(self):
+        """Write the on-disk store without seeded entries, a no-op without a path"""
+        if self.path is None:
+            return
+        self.stored.update(
+            (key, value) for key, value in self.entries.items() if not self.seeded(key)
+        )
+        temporary_path = "%s.tmp" % self.path
+        with open(temporary_path, "wb") as cache_file:
+            pickle.dump(
+                {"entries": self.stored, "stats": self.season_stats()}, cache_file, 2
+            )
+        os.rename(temporary_path, self.path)
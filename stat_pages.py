@@ -0,0 +1,177 @@
+"""Parse NAPA roster and stats pages from their HTML source
+
+The page is parsed once with lxml instead of asking the browser for every
+cell.  Rows are found with or without a tbody element, so the same parsers
+work on browser page_source and on HTML fetched over plain HTTP.
+"""
+
+import hashlib
+
+try:
+    from lxml import etree, html
+except ImportError:
+    etree = html = None
+
+BLOCK_TAGS = ("br", "div", "p", "h1", "h2", "h3", "h4", "h5", "h6", "li", "tr", "table")
+PAGE_SIZE = 10  # match cards on a full stats page
+CARD_BODY = "//*[contains(concat(' ', normalize-space(@class), ' '), ' card-body ')]"
+PLAYER_NAME = "/html/body/div/div/div/table[1]"
+SKILL_TABLE = "/html/body/div/div/div/table"
+SKILL_LEVEL_ROWS = (12, 13, 14)  # 8 ball, 9 ball, 10 ball
+ROSTER_TABLE = "/html/body/table"
+
+
+def parse(source):
+    """Parse page source into an lxml element tree
+
+    raises ValueError for source lxml can't parse, like an empty body
+    """
+    if html is None:
+        raise ImportError("lxml is required to parse page source")
+    try:
+        return html.fromstring(source)
+    except etree.LxmlError as error:
+        raise ValueError("Unparseable page: %s" % error)
+
+
+def element_text(element):
+    """Get the text of an element the way selenium renders it
+
+    Block elements and <br> start a new line, runs of whitespace collapse
+    to one space and blank lines are dropped.
+    """
+    chunks = []
+
+    def walk(node):
+        if node.tag in BLOCK_TAGS:
+            chunks.append("\n")
+        if node.text:
+            chunks.append(node.text)
+        for child in node:
+            if isinstance(child.tag, str):
+                walk(child)
+            if child.tail:
+                chunks.append(child.tail)
+        if node.tag in BLOCK_TAGS:
+            chunks.append("\n")
+
+    walk(element)
+    lines = [" ".join(line.split()) for line in "".join(chunks).split("\n")]
+    return "\n".join(line for line in lines if line)
+
+
+def rows(table):
+    """Get the rows of a table with or without a tbody"""
+    return table.xpath("./tbody/tr | ./tr")
+
+
+def cell(table, row, column):
+    """Get the text of a table cell, row and column count from 1 like xpath"""
+    return element_text(rows(table)[row - 1].xpath("./td")[column - 1])
+
+
+def match_key(text):
+    """Get a key that identifies a match card by its text"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def merge_results(results, new_results):
+    """Add the games won and lost in new_results to a copy of results
+
+    args:
+      results(dict):  results by skill difference (see collect_data.get_player_stats)
+      new_results(dict):  results to add
+
+    returns:
+      merged(dict):  results with new_results added, neither argument changes
+    """
+    merged = dict((diff, dict(games)) for diff, games in results.items())
+    for diff, games in new_results.items():
+        merged.setdefault(diff, {"games_won": 0, "games_lost": 0})
+        merged[diff]["games_won"] += games["games_won"]
+        merged[diff]["games_lost"] += games["games_lost"]
+    return merged
+
+
+def parse_rosters(source):
+    """Get players name and player ID per team from a division roster page
+
+    args:
+      source(str):  HTML of the division roster grid
+
+    returns:
+      players(dict):  see collect_data.get_rosters
+    """
+    players = {}
+    for row in rows(parse(source).xpath(ROSTER_TABLE)[0]):
+        for team in row.xpath("./td"):
+            tables = team.xpath("./table")
+            if not tables:  # empty cell at the end of an odd-sized division
+                continue
+            teamname = None
+            for player in rows(tables[0]):
+                data = element_text(player.xpath("./td")[1])
+                if teamname is None:
+                    teamname = data.split("\n")[0]
+                    players.setdefault(teamname, {})
+                else:
+                    playername, playerid = data.split("\n")
+                    players[teamname].setdefault(playername, {})
+                    players[teamname][playername]["player_id"] = playerid
+    return players
+
+
+def parse_skill_levels(source):
+    """Get 8ball, 9ball, 10ball skill levels from a player page
+
+    args:
+      source(str):  HTML of the player stats page
+
+    returns:
+      (unnamed list):  (8ball_skill_level, 9ball_skill_level, 10ball_skill_level)
+    """
+    table = parse(source).xpath(SKILL_TABLE)[0]
+    return [
+        int(element_text(rows(table)[row - 1].xpath("./td[2]/h5")[0]).split()[0])
+        for row in SKILL_LEVEL_ROWS
+    ]
+
+
+def parse_stats_page(source, results, watermark=None):
+    """Add the games won and lost on one stats page to results
+
+    args:
+      source(str):  HTML of a stats page for one game tab
+      results(dict):  Dictionary of the results by difference in games needed
+        to win the race, updated in place (see collect_data.get_player_stats)
+      watermark(str):  match_key of a match already counted, it and every
+        match after it on the page are skipped
+
+    returns:
+      keys(list):  match_key of each match card read, newest first.  Ends
+        with the watermark when it was found.
+    """
+    page = parse(source)
+    this_player = element_text(rows(page.xpath(PLAYER_NAME)[0])[1].xpath("./td/h2")[0])
+    keys = []
+    for match in page.xpath(CARD_BODY):
+        keys.append(match_key(element_text(match)))
+        if keys[-1] == watermark:
+            break
+        try:
+            tables = match.xpath("./table")
+            for table in tables[2:-2]:
+                if "y forfeit" in element_text(table):
+                    continue
+                player1 = cell(table, 2, 2).replace("\n", " ")
+                if player1 == this_player:
+                    mine, theirs = 2, 3
+                else:
+                    mine, theirs = 3, 2
+                skill_diff = int(cell(table, 3, mine)) - int(cell(table, 3, theirs))
+                results.setdefault(skill_diff, {"games_won": 0, "games_lost": 0})
+                results[skill_diff]["games_won"] += int(cell(table, 7, mine))
+                results[skill_diff]["games_lost"] += int(cell(table, 7, theirs))
+        except (IndexError, ValueError):  # FIXME: Learn how to process results from an "MVP player"
+            pass
+    return keys
@@ -0,0 +1,303 @@
+#! /usr/bin/python2
+"""Keep players, stats and predictions in an SQLite database
+
+Replaces data.pkl and predictions.pkl.  Records go in and come out in the
+same dict layout the pickles had, but a single player or matchup can be
+read or updated on its own, and several scripts can read at once (the
+database runs in WAL mode).
+
+Import existing pickles with
+
+    python storage.py data.pkl [predictions.pkl us_team opponent_team]
+"""
+
+import pickle
+import sqlite3
+import sys
+
+DATABASE = "napa.db"
+GAMES = ("8_ball", "9_ball", "10_ball")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    id INTEGER PRIMARY KEY,
+    team TEXT NOT NULL,
+    name TEXT NOT NULL,
+    player_id TEXT,
+    collected INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (team, name)
+);
+CREATE INDEX IF NOT EXISTS players_name ON players (name);
+CREATE INDEX IF NOT EXISTS players_player_id ON players (player_id);
+
+CREATE TABLE IF NOT EXISTS skill_levels (
+    player INTEGER NOT NULL REFERENCES players (id),
+    game TEXT NOT NULL,
+    skill_level INTEGER NOT NULL,
+    PRIMARY KEY (player, game)
+);
+
+CREATE TABLE IF NOT EXISTS stats (
+    player INTEGER NOT NULL REFERENCES players (id),
+    game TEXT NOT NULL,
+    skill_diff INTEGER NOT NULL,
+    games_won INTEGER NOT NULL,
+    games_lost INTEGER NOT NULL,
+    PRIMARY KEY (player, game, skill_diff)
+);
+
+CREATE TABLE IF NOT EXISTS watermarks (
+    player INTEGER NOT NULL REFERENCES players (id),
+    game TEXT NOT NULL,
+    match_key TEXT NOT NULL,
+    PRIMARY KEY (player, game)
+);
+
+CREATE TABLE IF NOT EXISTS predictions (
+    team TEXT NOT NULL,
+    player TEXT NOT NULL,
+    against_team TEXT NOT NULL,
+    against TEXT NOT NULL,
+    game TEXT NOT NULL,
+    value,
+    PRIMARY KEY (team, player, against_team, against, game)
+);
+CREATE INDEX IF NOT EXISTS predictions_player ON predictions (player);
+CREATE INDEX IF NOT EXISTS predictions_against ON predictions (against_team, against);
+"""
+
+
+class Storage(object):
+    """Players, stats and predictions in an SQLite database
+
+    Player records look like collect_data.py's: player_id, and once the
+    player is collected skill_level, 8_ball, 9_ball, 10_ball and watermarks.
+    Saving a record that was not collected, like a player whose pages
+    failed to load, keeps the stats saved for that player ID.
+
+    args:
+      path(str):  database file, created when missing
+    """
+
+    def __init__(self, path=DATABASE):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def save_player(self, team, name, record):
+        """Insert or update one player, only that player's rows are written"""
+        with self.connection:
+            self._save_player(team, name, record)
+
+    def save_players(self, players):
+        """Insert or update every player of players(dict) {team: {name: record}}"""
+        with self.connection:
+            for team in players:
+                for name in players[team]:
+                    self._save_player(team, name, players[team][name])
+
+    def _save_player(self, team, name, record):
+        cursor = self.connection.cursor()
+        cursor.execute(
+            "INSERT OR IGNORE INTO players (team, name) VALUES (?, ?)", (team, name)
+        )
+        player, player_id = cursor.execute(
+            "SELECT id, player_id FROM players WHERE team = ? AND name = ?",
+            (team, name),
+        ).fetchone()
+        collected = "skill_level" in record
+        if not collected and record.get("player_id") in (None, player_id):
+            # not collected this time (or it failed), keep what was saved before
+            return
+        cursor.execute(
+            "UPDATE players SET player_id = ?, collected = ? WHERE id = ?",
+            (record.get("player_id"), 1 if collected else 0, player),
+        )
+        for table in ("skill_levels", "stats", "watermarks"):
+            cursor.execute("DELETE FROM %s WHERE player = ?" % table, (player,))
+        if not collected:
+            return
+        if record["skill_level"] is not None:
+            cursor.executemany(
+                "INSERT INTO skill_levels VALUES (?, ?, ?)",
+                [
+                    (player, game, skill_level)
+                    for game, skill_level in zip(GAMES, record["skill_level"])
+                ],
+            )
+        cursor.executemany(
+            "INSERT INTO stats VALUES (?, ?, ?, ?, ?)",
+            [
+                (player, game, skill_diff, games["games_won"], games["games_lost"])
+                for game in GAMES
+                for skill_diff, games in (record.get(game) or {}).items()
+            ],
+        )
+        cursor.executemany(
+            "INSERT INTO watermarks VALUES (?, ?, ?)",
+            [
+                (player, game, match_key)
+                for game, match_key in record.get("watermarks", {}).items()
+                if match_key is not None
+            ],
+        )
+
+    def load_player(self, team, name):
+        """Get one player's record, None when the player is not stored"""
+        players = self._load("WHERE team = ? AND name = ?", (team, name))
+        return players.get(team, {}).get(name)
+
+    def load_players(self, teams=None):
+        """Get players by team
+
+        args:
+          teams(list):  team names to load, None for every team
+
+        returns:
+          players(dict):  {team: {name: record}} like data.pkl
+        """
+        if teams is None:
+            return self._load("", ())
+        return self._load(
+            "WHERE team IN (%s)" % ", ".join("?" * len(teams)), tuple(teams)
+        )
+
+    def _load(self, where, arguments):
+        players = {}
+        records = {}
+        for player, team, name, player_id, collected in self.connection.execute(
+            "SELECT id, team, name, player_id, collected FROM players %s ORDER BY id"
+            % where,
+            arguments,
+        ):
+            record = {"player_id": player_id}
+            if collected:
+                record["skill_level"] = None
+                record["watermarks"] = dict((game, None) for game in GAMES)
+                for game in GAMES:
+                    record[game] = {}
+            players.setdefault(team, {})[name] = record
+            records[player] = record
+        if not records:
+            return players
+        selected = "SELECT id FROM players %s" % where
+        skill_levels = {}
+        for player, game, skill_level in self.connection.execute(
+            "SELECT player, game, skill_level FROM skill_levels WHERE player IN (%s)"
+            % selected,
+            arguments,
+        ):
+            skill_levels.setdefault(player, {})[game] = skill_level
+        for player, levels in skill_levels.items():
+            records[player]["skill_level"] = [levels.get(game) for game in GAMES]
+        for player, game, skill_diff, games_won, games_lost in self.connection.execute(
+            "SELECT player, game, skill_diff, games_won, games_lost FROM stats "
+            "WHERE player IN (%s)" % selected,
+            arguments,
+        ):
+            records[player][game][skill_diff] = {
+                "games_won": games_won,
+                "games_lost": games_lost,
+            }
+        for player, game, match_key in self.connection.execute(
+            "SELECT player, game, match_key FROM watermarks WHERE player IN (%s)"
+            % selected,
+            arguments,
+        ):
+            records[player]["watermarks"][game] = match_key
+        return players
+
+    def save_predictions(self, predictions, team, against_team):
+        """Replace the predictions for one team against another
+
+        args:
+          predictions(dict):  {player: {against: {game: value}}} like
+            predictions.pkl, game includes "combined"
+          team(str):  team of player
+          against_team(str):  team of against
+        """
+        with self.connection:
+            self._save_predictions(predictions, team, against_team)
+
+    def save_prediction_matrix(self, matrix):
+        """Replace the predictions for many pairs of teams in one transaction
+
+        args:
+          matrix(dict):  {(team, against_team): predictions} with predictions
+            like save_predictions
+        """
+        with self.connection:
+            for (team, against_team), predictions in sorted(matrix.items()):
+                self._save_predictions(predictions, team, against_team)
+
+    def _save_predictions(self, predictions, team, against_team):
+        self.connection.execute(
+            "DELETE FROM predictions WHERE team = ? AND against_team = ?",
+            (team, against_team),
+        )
+        self.connection.executemany(
+            "INSERT INTO predictions VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    team,
+                    player,
+                    against_team,
+                    against,
+                    game,
+                    # an unfilled "combined" is an empty dict
+                    None if isinstance(value, dict) else value,
+                )
+                for player in predictions
+                for against in predictions[player]
+                for game, value in predictions[player][against].items()
+            ],
+        )
+
+    def load_predictions(self, team, against_team, player=None, against=None):
+        """Get the predictions for one team against another
+
+        args:
+          team(str):  team of player
+          against_team(str):  team of against
+          player(str):  optional, only this player's predictions
+          against(str):  optional, only predictions against this player
+
+        returns:
+          predictions(dict):  {player: {against: {game: value}}} like
+            predictions.pkl
+        """
+        query = (
+            "SELECT player, against, game, value FROM predictions "
+            "WHERE team = ? AND against_team = ?"
+        )
+        arguments = [team, against_team]
+        if player is not None:
+            query += " AND player = ?"
+            arguments.append(player)
+        if against is not None:
+            query += " AND against = ?"
+            arguments.append(against)
+        predictions = {}
+        for player, against, game, value in self.connection.execute(
+            query + " ORDER BY rowid", arguments
+        ):
+            predictions.setdefault(player, {}).setdefault(against, {})[game] = (
+                {} if value is None else value
+            )
+        return predictions
+
+
+if __name__ == "__main__":
+    storage = Storage()
+    with open(sys.argv[1], "rb") as data_file:
+        storage.save_players(pickle.load(data_file))
+    if len(sys.argv) > 4:
+        with open(sys.argv[2], "rb") as predictions_file:
+            storage.save_predictions(
+                pickle.load(predictions_file), sys.argv[3], sys.argv[4]
+            )
+    storage.close()